@@ -0,0 +1,210 @@
+"""
+Synthetic-data benchmark suite for movie_recommender.py.
+
+Generates seeded, MovieLens-shaped movie and ratings files (skewed movie
+popularity and user activity, many genres), then times every recommender
+function and records its peak memory. Results are written as JSON so runs can
+be compared against each other.
+
+Example:
+    python benchmark_movie_recommender.py --sizes 10000,1000000 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from itertools import accumulate
+
+import movie_recommender as mr
+
+GENRES = [
+    "Action", "Adventure", "Animation", "Children", "Comedy", "Crime",
+    "Documentary", "Drama", "Fantasy", "Film-Noir", "Horror", "IMAX",
+    "Musical", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western",
+]
+RATING_VALUES = ["0.5", "1.0", "1.5", "2.0", "2.5", "3.0", "3.5", "4.0", "4.5", "5.0"]
+# Roughly the MovieLens rating histogram: most ratings are 3.0-4.0
+RATING_WEIGHTS = [1, 3, 2, 7, 5, 20, 13, 27, 9, 13]
+
+
+def _zipf_cum_weights(count, exponent):
+    """Cumulative Zipf weights, so item 0 is the most popular."""
+    return list(accumulate(1.0 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+def generate_dataset(directory, n_ratings, n_movies=None, n_users=None, seed=0):
+    """
+    Write a seeded synthetic dataset into `directory`.
+
+    Movie count and user count default to MovieLens-like ratios of the rating
+    count (~1 movie per 400 ratings, ~1 user per 150 ratings). Movie
+    popularity and user activity both follow a Zipf distribution. Returns
+    (movies file, ratings file).
+    """
+    rnd = random.Random(seed)
+    n_movies = n_movies or max(10, n_ratings // 400)
+    n_users = n_users or max(10, n_ratings // 150)
+
+    movies_file = os.path.join(directory, f"movies_{n_ratings}.txt")
+    ratings_file = os.path.join(directory, f"ratings_{n_ratings}.txt")
+
+    names = [f"Synthetic Movie {i} ({1950 + i % 70})" for i in range(n_movies)]
+    with open(movies_file, "w") as f:
+        for movie_id, name in enumerate(names, 1):
+            f.write(f"{rnd.choice(GENRES)}|{movie_id}|{name}\n")
+
+    movie_weights = _zipf_cum_weights(n_movies, 1.0)
+    user_weights = _zipf_cum_weights(n_users, 0.8)
+    rating_weights = list(accumulate(RATING_WEIGHTS))
+    batch = 100_000
+    with open(ratings_file, "w") as f:
+        for start in range(0, n_ratings, batch):
+            size = min(batch, n_ratings - start)
+            movies = rnd.choices(range(n_movies), cum_weights=movie_weights, k=size)
+            users = rnd.choices(range(1, n_users + 1), cum_weights=user_weights, k=size)
+            values = rnd.choices(RATING_VALUES, cum_weights=rating_weights, k=size)
+            f.writelines(
+                f"{names[m]}|{v}|{u}\n" for m, v, u in zip(movies, values, users)
+            )
+    return movies_file, ratings_file
+
+
+def _measure(func, *args, **kwargs):
+    """Run func once for wall time and once under tracemalloc for peak memory."""
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def _record(results, name, calls, elapsed, peak):
+    results.append(
+        {
+            "function": name,
+            "calls": calls,
+            "total_s": elapsed,
+            "per_call_s": elapsed / calls,
+            "peak_bytes": peak,
+        }
+    )
+
+
+def benchmark_dataset(movies_file, ratings_file, n=10, queries=20, seed=0, workers=1):
+    """
+    Time every recommender function on one dataset; returns a list of result dicts.
+
+    The query cache is disabled meanwhile, so repeated and sampled queries
+    measure the functions themselves rather than cache hits.
+    """
+    maxsize, mr.QUERY_CACHE.maxsize = mr.QUERY_CACHE.maxsize, 0
+    try:
+        return _benchmark_dataset(movies_file, ratings_file, n, queries, seed, workers)
+    finally:
+        mr.QUERY_CACHE.maxsize = maxsize
+
+
+def _benchmark_dataset(movies_file, ratings_file, n, queries, seed, workers):
+    results = []
+    movies, elapsed, peak = _measure(mr.load_movies_file, movies_file)
+    _record(results, "load_movies_file", 1, elapsed, peak)
+    ratings, elapsed, peak = _measure(mr.load_ratings_file, ratings_file, workers=workers)
+    _record(results, "load_ratings_file", 1, elapsed, peak)
+
+    _, elapsed, peak = _measure(mr.movie_popularity, ratings, n)
+    _record(results, "movie_popularity", 1, elapsed, peak)
+    _, elapsed, peak = _measure(mr.genre_popularity, movies, ratings, n)
+    _record(results, "genre_popularity", 1, elapsed, peak)
+
+    rnd = random.Random(seed)
+    genres = sorted({genre for genre, _ in movies.values()})
+    sample_genres = [rnd.choice(genres) for _ in range(queries)]
+    users = ratings.user_ids()
+    sample_users = [rnd.choice(users) for _ in range(queries)]
+
+    per_query = [
+        ("movie_popularity_in_genre", lambda g, u: mr.movie_popularity_in_genre(movies, ratings, g, n)),
+        ("user_preference", lambda g, u: mr.user_preference(movies, ratings, u)),
+        ("recommend_movies", lambda g, u: mr.recommend_movies(u, movies, ratings)),
+    ]
+    for name, query in per_query:
+        def run_all(query=query):
+            for genre, user in zip(sample_genres, sample_users):
+                query(genre, user)
+        _, elapsed, peak = _measure(run_all)
+        _record(results, name, queries, elapsed, peak)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default="10000,100000",
+        help="comma-separated rating counts to benchmark (e.g. 10000,1000000,25000000)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed for data and queries")
+    parser.add_argument("--n", type=int, default=10, help="N used for the top-N queries")
+    parser.add_argument("--queries", type=int, default=20, help="calls per per-user/per-genre function")
+    parser.add_argument("--workers", type=int, default=1, help="processes used to load ratings")
+    parser.add_argument("--data-dir", help="keep generated files here instead of a temp dir")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "n": args.n,
+            "queries": args.queries,
+            "workers": args.workers,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.data_dir or tmp
+        os.makedirs(directory, exist_ok=True)
+        for size in sizes:
+            print(f"Generating {size} ratings...", file=sys.stderr)
+            movies_file, ratings_file = generate_dataset(directory, size, seed=args.seed)
+            print(f"Benchmarking {size} ratings...", file=sys.stderr)
+            results = benchmark_dataset(
+                movies_file, ratings_file, args.n, args.queries, args.seed, args.workers
+            )
+            report["runs"].append(
+                {
+                    "ratings": size,
+                    "ratings_file_bytes": os.path.getsize(ratings_file),
+                    "results": results,
+                }
+            )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
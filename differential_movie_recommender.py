@@ -0,0 +1,626 @@
+"""
+Randomised differential tests for the optimised paths in movie_recommender.py.
+
+Generates seeded synthetic datasets, clean ones (see
+benchmark_movie_recommender.py) and messy ones with case-variant and redefined
+titles, padded genres and malformed rows. It then answers the same random
+queries with a port of the original dict-based implementation and with every
+optimised engine, reports any answer that differs (ties and float averages
+included) and times each engine's load and queries next to the reference.
+
+Example:
+    python differential_movie_recommender.py --sizes 100000,1000000 --output diff.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import benchmark_movie_recommender as bench
+import movie_recommender as mr
+
+MISSING_GENRE = "No Such Genre"
+MISSING_USER = -1
+RANKING_QUERIES = ("movie_popularity", "movie_popularity_in_genre", "genre_popularity")
+ALL_QUERIES = RANKING_QUERIES + ("user_preference", "recommend_movies")
+INCREMENTAL_SINGLE_ROWS = 20  # ratings the incremental engine ingests one at a time
+
+
+def generate_messy_dataset(directory, n_ratings, n_movies=None, n_users=None, seed=0):
+    """
+    Write a seeded dataset full of the inputs the loaders must tolerate.
+
+    Movies are redefined later in the file with another genre, repeated with
+    a differently cased title, and given upper-case or space-padded genres;
+    ratings name titles in any case, titles missing from the catalogue, and
+    include malformed lines and non-numeric ratings or user ids. A few titles
+    get a new spelling in the last rows, which takes over the case-insensitive
+    join from the one their early raters used; each of those raters' preferred
+    genre changes with it. Returns (movies file, ratings file).
+    """
+    rnd = random.Random(seed)
+    n_movies = n_movies or max(10, n_ratings // 200)
+    n_users = n_users or max(10, n_ratings // 100)
+
+    movies_file = os.path.join(directory, f"messy_movies_{n_ratings}.txt")
+    ratings_file = os.path.join(directory, f"messy_ratings_{n_ratings}.txt")
+
+    def genre():
+        name = rnd.choice(bench.GENRES[:8])
+        roll = rnd.random()
+        if roll < 0.1:
+            return name.upper()
+        if roll < 0.2:
+            return f" {name.lower()}  "
+        return name
+
+    def variant(title):
+        roll = rnd.random()
+        if roll < 0.1:
+            return title.upper()
+        if roll < 0.2:
+            return title.lower()
+        return title
+
+    titles = [f"Messy Movie {i}" for i in range(n_movies)]
+    late_titles = [(f"Late Movie {j}", f"Late Partner {j}", f"Late Other {j}") for j in range(3)]
+    with open(movies_file, "w") as f:
+        for movie_id, title in enumerate(titles, 1):
+            f.write(f"{genre()}|{movie_id}|{variant(title)}\n")
+            if rnd.random() < 0.05:
+                f.write(rnd.choice(["Drama|only two", "", "a|b|c|d"]) + "\n")
+        # Redefine a few titles several times each, so an exact title often
+        # returns after a case variant of it was added
+        churn = max(3, n_movies // 10)
+        for _ in range(n_movies // 3):
+            movie_id = rnd.randrange(1, churn + 1)
+            f.write(f"{genre()}|{movie_id}|{variant(titles[movie_id - 1])}\n")
+        movie_id = n_movies
+        for j, names in enumerate(late_titles):
+            genres = (bench.GENRES[j], bench.GENRES[j], bench.GENRES[j + 1])
+            for name, genre_name in zip(names, genres):
+                movie_id += 1
+                f.write(f"{genre_name}|{movie_id}|{name}\n")
+
+    values = bench.RATING_VALUES
+    late_users = range(n_users + 1, n_users + 1 + max(3, n_users // 4))
+    with open(ratings_file, "w") as f:
+        # Early raters of each late title: genre averages 3.0 (the title and
+        # its partner) against 4.0, until the title drops out of the join
+        for user_id in late_users:
+            title, partner, other = late_titles[user_id % len(late_titles)]
+            f.write(f"{title}|1.0|{user_id}\n{partner}|5.0|{user_id}\n{other}|4.0|{user_id}\n")
+        for _ in range(n_ratings):
+            roll = rnd.random()
+            if roll < 0.01:
+                f.write(rnd.choice(["no separators here", "a|b", "x|1|2|3", ""]) + "\n")
+                continue
+            title = variant(rnd.choice(titles)) if roll > 0.03 else f"Unknown Movie {roll}"
+            rating = rnd.choice(values) if rnd.random() > 0.01 else "great"
+            user_id = rnd.randrange(1, n_users + 1) if rnd.random() > 0.005 else "someone"
+            f.write(f"{title}|{rating}|{user_id}\n")
+        for title, _, _ in late_titles:
+            f.write(f"{title.lower()}|3.0|{rnd.randrange(1, n_users + 1)}\n")
+    return movies_file, ratings_file
+
+
+# Reference implementation: the original dict-based module, returning its
+# answers instead of printing them. Two deliberate changes made since are
+# applied here too: a row with a bad rating no longer registers its movie,
+# and genres are compared with surrounding whitespace stripped.
+
+
+def reference_load(movies_file, ratings_file):
+    """Load both files into plain dicts the way the original loaders did."""
+    movies = {}
+    with open(movies_file) as f:
+        for line in f:
+            parts = line.strip().split("|")
+            if len(parts) != 3:
+                continue
+            genre, movie_id, name = parts
+            movies[name] = (genre, movie_id)
+    ratings = {}
+    with open(ratings_file) as f:
+        for line in f:
+            parts = line.strip().split("|")
+            if len(parts) != 3:
+                continue
+            name, rating, user_id = parts
+            try:
+                row = (float(rating), int(user_id))
+            except ValueError:
+                continue
+            ratings.setdefault(name, []).append(row)
+    return movies, ratings
+
+
+def reference_movie_popularity(ratings, n):
+    averages = {}
+    for movie in ratings:
+        just_ratings = [r for r, u in ratings[movie]]
+        averages[movie] = sum(just_ratings) / len(just_ratings)
+    return sorted(averages.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+def reference_movie_popularity_in_genre(movies, ratings, genre, n):
+    movie_scores = {}
+    for movie_name, (movie_genre, movie_id) in movies.items():
+        if movie_genre.strip().lower() == genre.strip().lower():
+            if movie_name in ratings:
+                scores = [r for r, _ in ratings[movie_name]]
+                movie_scores[movie_name] = sum(scores) / len(scores)
+    return sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)[:n]
+
+
+def reference_genre_popularity(movies, ratings, n):
+    movies_lower = {name.lower(): (vals[0].strip().lower(), *vals[1:]) for name, vals in movies.items()}
+    ratings_lower = {name.lower(): val for name, val in ratings.items()}
+    movie_avg = {}
+    for movie_name, rating_list in ratings_lower.items():
+        movie_avg[movie_name] = sum(r for r, _ in rating_list) / len(rating_list)
+    genre_totals = {}
+    genre_counts = {}
+    for movie_name, avg in movie_avg.items():
+        if movie_name in movies_lower:
+            genre = movies_lower[movie_name][0]
+            genre_totals[genre] = genre_totals.get(genre, 0) + avg
+            genre_counts[genre] = genre_counts.get(genre, 0) + 1
+    genre_avg = {g: genre_totals[g] / genre_counts[g] for g in genre_totals}
+    sorted_genres = sorted(genre_avg.items(), key=lambda x: x[1], reverse=True)
+    return [(genre.title(), avg) for genre, avg in sorted_genres[:n]]
+
+
+def reference_user_preference(movies, ratings, user_id):
+    movies_lower = {name.lower(): (vals[0].strip().lower(), *vals[1:]) for name, vals in movies.items()}
+    ratings_lower = {name.lower(): val for name, val in ratings.items()}
+    genre_totals = {}
+    genre_counts = {}
+    for movie_name, rating_list in ratings_lower.items():
+        if movie_name not in movies_lower:
+            continue
+        user_ratings = [r for r, uid in rating_list if uid == user_id]
+        if user_ratings:
+            genre = movies_lower[movie_name][0]
+            genre_totals[genre] = genre_totals.get(genre, 0) + sum(user_ratings) / len(user_ratings)
+            genre_counts[genre] = genre_counts.get(genre, 0) + 1
+    if not genre_totals:
+        return None
+    genre_avg = {g: genre_totals[g] / genre_counts[g] for g in genre_totals}
+    return max(genre_avg.items(), key=lambda x: x[1])[0].title()
+
+
+def reference_recommend_movies(user_id, movies, ratings, top=3):
+    preferred_genre = reference_user_preference(movies, ratings, user_id)
+    if not preferred_genre:
+        return None, []
+    genre_movies = [
+        name for name, (genre, mid) in movies.items()
+        if genre.strip().lower() == preferred_genre.lower()
+    ]
+    rated_movies = set()
+    for movie_name, rating_list in ratings.items():
+        for _, uid in rating_list:
+            if uid == user_id:
+                rated_movies.add(movie_name)
+    movie_scores = {}
+    for movie_name in genre_movies:
+        if movie_name not in rated_movies and movie_name in ratings:
+            scores = [r for r, _ in ratings[movie_name]]
+            movie_scores[movie_name] = sum(scores) / len(scores)
+    sorted_recs = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
+    return preferred_genre, [movie for movie, _ in sorted_recs[:top]]
+
+
+def make_queries(movies, ratings, count, seed=0):
+    """Random queries over the dataset, including out-of-range N and unknown keys."""
+    rnd = random.Random(seed)
+    genres = sorted({genre for genre, _ in movies.values()})
+    genres += [genre.upper() for genre in genres[:2]] + [MISSING_GENRE]
+    users = sorted({uid for values in ratings.values() for _, uid in values})
+    sizes = [0, 1, 3, 10, len(ratings) + 5]
+    queries = []
+    for _ in range(count):
+        queries.append(("movie_popularity", rnd.choice(sizes)))
+        queries.append(("movie_popularity_in_genre", rnd.choice(genres), rnd.choice(sizes)))
+        queries.append(("genre_popularity", rnd.choice(sizes)))
+        user_id = rnd.choice(users + [MISSING_USER])
+        queries.append(("user_preference", user_id))
+        queries.append(("recommend_movies", user_id))
+    return queries
+
+
+# Every engine returns answers in one canonical form:
+#   movie_popularity / movie_popularity_in_genre -> [(movie, avg), ...]
+#   genre_popularity -> [(lowercase genre, avg), ...]
+#   user_preference -> lowercase genre or None
+#   recommend_movies -> (lowercase genre or None, [movie, ...])
+
+
+def _lower(genre):
+    return genre.lower() if genre else None
+
+
+def _genres(pairs):
+    return [(genre.lower(), avg) for genre, avg in pairs]
+
+
+def reference_answers(movies, ratings, queries):
+    answers = []
+    for query in queries:
+        kind = query[0]
+        if kind == "movie_popularity":
+            answers.append(reference_movie_popularity(ratings, query[1]))
+        elif kind == "movie_popularity_in_genre":
+            answers.append(reference_movie_popularity_in_genre(movies, ratings, query[1], query[2]))
+        elif kind == "genre_popularity":
+            answers.append(_genres(reference_genre_popularity(movies, ratings, query[1])))
+        elif kind == "user_preference":
+            answers.append(_lower(reference_user_preference(movies, ratings, query[1])))
+        else:
+            genre, recs = reference_recommend_movies(query[1], movies, ratings)
+            answers.append((_lower(genre), recs))
+    return answers
+
+
+def _engine_answers(engine, queries):
+    """Answer queries through a QueryEngine."""
+    answers = []
+    for query in queries:
+        kind = query[0]
+        if kind == "movie_popularity":
+            answers.append(engine.movie_popularity(query[1]))
+        elif kind == "movie_popularity_in_genre":
+            answers.append(engine.movie_popularity_in_genre(query[1], query[2]))
+        elif kind == "genre_popularity":
+            answers.append(_genres(engine.genre_popularity(query[1])))
+        elif kind == "user_preference":
+            preference = engine.user_preference(query[1])
+            answers.append(_lower(preference[0]) if preference else None)
+        else:
+            genre, recs = engine.recommend_movies(query[1])
+            answers.append((_lower(genre), [m for m, _ in recs]))
+    return answers
+
+
+def _function_answers(movies, ratings, queries, workers=1):
+    """Answer queries with the list-returning module functions and batch recommender."""
+    users = sorted({q[1] for q in queries if q[0] == "recommend_movies"})
+    recs = mr.recommend_movies_batch(movies, ratings, users, workers=workers) if users else {}
+    answers = []
+    for query in queries:
+        kind = query[0]
+        if kind == "movie_popularity":
+            answers.append(mr.top_movies(ratings, query[1]))
+        elif kind == "movie_popularity_in_genre":
+            answers.append(mr.top_movies_in_genre(movies, ratings, query[1], query[2]))
+        elif kind == "genre_popularity":
+            answers.append(_genres(mr.top_genres(movies, ratings, query[1])))
+        elif kind == "user_preference":
+            answers.append(_lower(mr.user_preference(movies, ratings, query[1])))
+        else:
+            genre = mr.user_preference(movies, ratings, query[1])
+            answers.append((_lower(genre), [m for m, _ in recs[query[1]]]))
+    return answers
+
+
+def _cached_answers(movies, ratings, queries):
+    """Answer every query twice through the query cache and keep the cached copy."""
+    mr.QUERY_CACHE.invalidate()
+    _function_answers(movies, ratings, queries)
+    answers = _function_answers(movies, ratings, queries)
+    mr.QUERY_CACHE.invalidate()
+    return answers
+
+
+def _table_answers(table, queries):
+    """Recommendations read from a RecommendationTable."""
+    answers = []
+    for query in queries:
+        entry = table.lookup(query[1])
+        if entry is None:
+            answers.append((None, []))
+        else:
+            answers.append((_lower(entry[0]), [m for m, _ in entry[1]]))
+    return answers
+
+
+def _snapshot_answers(movies, ratings, queries, threads):
+    """Answer queries as query dicts on a SnapshotQueryExecutor thread pool."""
+    fields = {
+        "movie_popularity": ("n",),
+        "movie_popularity_in_genre": ("genre", "n"),
+        "genre_popularity": ("n",),
+        "user_preference": ("user_id",),
+        "recommend_movies": ("user_id",),
+    }
+    dicts = [dict(zip(fields[q[0]], q[1:]), query=q[0]) for q in queries]
+    live = mr.LiveDataset(mr.DatasetSnapshot(movies, ratings))
+    with mr.SnapshotQueryExecutor(live, max_workers=threads) as executor:
+        responses = executor.map(dicts)
+    answers = []
+    for query, response in zip(queries, responses):
+        result = response["result"]
+        kind = query[0]
+        if kind in ("movie_popularity", "movie_popularity_in_genre"):
+            answers.append([tuple(pair) for pair in result])
+        elif kind == "genre_popularity":
+            answers.append(_genres(result))
+        elif kind == "user_preference":
+            answers.append(_lower(result[0]) if result else None)
+        else:
+            answers.append((_lower(result["genre"]), [m for m, _ in result["movies"]]))
+    return answers
+
+
+def _write_shards(ratings_file, directory, shards):
+    """Split a ratings file into `shards` consecutive pieces named in merge order."""
+    os.makedirs(directory, exist_ok=True)
+    with open(ratings_file) as f:
+        lines = f.readlines()
+    size = -(-len(lines) // shards)
+    for i in range(shards):
+        with open(os.path.join(directory, f"part-{i:03d}.txt"), "w") as f:
+            f.writelines(lines[i * size : (i + 1) * size])
+    return directory
+
+
+def _mapped_load(movies_file, ratings_file, directory):
+    """Load both files from freshly written binary snapshots (the memory-mapped path)."""
+    copies = []
+    for path in (movies_file, ratings_file):
+        copy = os.path.join(directory, os.path.basename(path))
+        with open(path) as src, open(copy, "w") as dst:
+            dst.write(src.read())
+        copies.append(copy)
+    mr.load_movies_file(copies[0], snapshot=True)
+    mr.load_ratings_file(copies[1], snapshot=True)
+    start = time.perf_counter()
+    movies = mr.load_movies_file(copies[0], snapshot=True)
+    ratings = mr.load_ratings_file(copies[1], snapshot=True)
+    if ratings._snapshot is None:
+        raise RuntimeError("ratings snapshot was not memory-mapped")
+    return (movies, ratings), time.perf_counter() - start
+
+
+def _incremental_load(movies, ratings_file, directory):
+    """
+    Load the first half of the ratings, build a recommendation table, then
+    bring in the rest: appended to the file and picked up by a RatingsTail,
+    through ingest_ratings_rows, and through LiveDataset.ingest (a new
+    RatingsView each time), the last rows one at a time. The table is updated
+    after each step, not rebuilt; single rows touch few genres, so update()
+    has to find every affected user itself.
+    """
+    with open(ratings_file) as f:
+        lines = f.readlines()
+    half = len(lines) // 2
+    single = max(half, len(lines) - INCREMENTAL_SINGLE_ROWS)
+    middle = (half + single) // 2
+    parts = [lines[half:middle], lines[middle:single], lines[single:]]
+    path = os.path.join(directory, "incremental_" + os.path.basename(ratings_file))
+    with open(path, "w") as f:
+        f.writelines(lines[:half])
+
+    start = time.perf_counter()
+    store = mr.load_ratings_file(path)
+    table = mr.RecommendationTable.build(movies, store)
+    tail = mr.RatingsTail(path)
+    with open(path, "a") as f:
+        f.writelines(parts[0])
+    tail.poll(store)
+    mr.ingest_ratings_rows(store, [line.rstrip("\n") for line in parts[1]])
+    table.update(movies, store)
+    live = mr.LiveDataset(mr.DatasetSnapshot(movies, store))
+    for line in parts[2]:
+        live.ingest([line.rstrip("\n")])
+        snapshot = live.current()
+        table.update(snapshot.movies, snapshot.ratings)
+    snapshot = live.current()
+    if not table.is_current(snapshot.movies, snapshot.ratings):
+        raise RuntimeError("updated recommendation table is not current")
+    engine = mr.QueryEngine(snapshot.movies, snapshot.ratings, table)
+    return engine, time.perf_counter() - start
+
+
+def _timed(func, *args, **kwargs):
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_differential(movies_file, ratings_file, queries=20, seed=0, workers=2, max_reported=5):
+    """
+    Compare every engine with the reference on one dataset.
+
+    Each engine answers only the query kinds it implements and is checked on
+    those alone. Returns a list of per-engine dicts: the queries checked,
+    load and query seconds and their ratio to the reference, the number of
+    mismatching answers and the first few mismatches as
+    (query, expected, actual).
+    """
+    (ref_movies, ref_ratings), ref_load = _timed(reference_load, movies_file, ratings_file)
+    query_list = make_queries(ref_movies, ref_ratings, queries, seed)
+    expected, ref_query = _timed(reference_answers, ref_movies, ref_ratings, query_list)
+
+    (movies, ratings), base_load = _timed(
+        lambda: (mr.load_movies_file(movies_file), mr.load_ratings_file(ratings_file))
+    )
+    with tempfile.TemporaryDirectory(prefix="differential-") as work_dir:
+        engines = _engines(movies_file, ratings_file, movies, ratings, base_load, work_dir, workers)
+        results = [
+            {
+                "engine": "reference",
+                "queries": len(query_list),
+                "load_s": ref_load,
+                "query_s": ref_query,
+                "load_ratio": 1.0,
+                "query_ratio": 1.0,
+                "mismatches": 0,
+                "examples": [],
+            }
+        ]
+        for name, kinds, load_data, answer in engines:
+            covered = [i for i, query in enumerate(query_list) if query[0] in kinds]
+            subset = [query_list[i] for i in covered]
+            with redirect_stdout(io.StringIO()):
+                data, load_s = load_data()
+            actual, query_s = _timed(answer, data, subset)
+            wrong = [
+                (query_list[i], expected[i], got)
+                for i, got in zip(covered, actual)
+                if expected[i] != got
+            ]
+            ref_share = ref_query * len(covered) / len(query_list) if query_list else 0.0
+            results.append(
+                {
+                    "engine": name,
+                    "queries": len(covered),
+                    "load_s": load_s,
+                    "query_s": query_s,
+                    "load_ratio": load_s / ref_load if ref_load else None,
+                    "query_ratio": query_s / ref_share if ref_share else None,
+                    "mismatches": len(wrong),
+                    "examples": [list(example) for example in wrong[:max_reported]],
+                }
+            )
+    return results
+
+
+def _engines(movies_file, ratings_file, movies, ratings, base_load, work_dir, workers):
+    """
+    Return (name, query kinds answered, load() -> (data, seconds),
+    answer(data, queries)) for every optimised engine.
+    """
+
+    def loaded():
+        return (movies, ratings), base_load
+
+    def load(func, *args, **kwargs):
+        return lambda: _timed(func, *args, **kwargs)
+
+    return [
+        ("indexed", ALL_QUERIES, loaded, lambda d, q: _engine_answers(mr.QueryEngine(*d), q)),
+        ("functions", ALL_QUERIES, loaded, lambda d, q: _function_answers(*d, q)),
+        ("cached", ALL_QUERIES, loaded, lambda d, q: _cached_answers(*d, q)),
+        (
+            "parallel",
+            ALL_QUERIES,
+            load(lambda: (movies, mr.load_ratings_file(ratings_file, workers=workers))),
+            lambda d, q: _function_answers(*d, q, workers=workers),
+        ),
+        (
+            "shards",
+            ALL_QUERIES,
+            load(
+                lambda: (
+                    movies,
+                    mr.load_ratings_shards(
+                        _write_shards(ratings_file, os.path.join(work_dir, "shards"), 4), workers
+                    ),
+                )
+            ),
+            lambda d, q: _engine_answers(mr.QueryEngine(*d), q),
+        ),
+        (
+            "mmap",
+            ALL_QUERIES,
+            lambda: _mapped_load(movies_file, ratings_file, work_dir),
+            lambda d, q: _engine_answers(mr.QueryEngine(*d), q),
+        ),
+        (
+            "streaming",
+            RANKING_QUERIES,
+            load(lambda: (movies, mr.stream_ratings_aggregates(ratings_file))),
+            lambda d, q: _function_answers(*d, q),
+        ),
+        (
+            "table",
+            ("recommend_movies",),
+            load(mr.RecommendationTable.build, movies, ratings),
+            _table_answers,
+        ),
+        ("snapshot", ALL_QUERIES, loaded, lambda d, q: _snapshot_answers(*d, q, workers)),
+        (
+            "incremental",
+            ALL_QUERIES,
+            lambda: _incremental_load(movies, ratings_file, work_dir),
+            _engine_answers,
+        ),
+    ]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", default="10000,100000", help="comma-separated rating counts to test"
+    )
+    parser.add_argument(
+        "--data", default="clean,messy", help="comma-separated dataset kinds: clean, messy"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed for data and queries")
+    parser.add_argument("--queries", type=int, default=20, help="queries of each kind per dataset")
+    parser.add_argument("--workers", type=int, default=2, help="processes/threads for parallel engines")
+    parser.add_argument("--data-dir", help="keep generated files here instead of a temp dir")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+GENERATORS = {"clean": bench.generate_dataset, "messy": generate_messy_dataset}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    kinds = args.data.split(",")
+    unknown = [kind for kind in kinds if kind not in GENERATORS]
+    if unknown:
+        sys.exit(f"unknown dataset kind: {', '.join(unknown)}")
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "queries": args.queries,
+            "workers": args.workers,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "runs": [],
+    }
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.data_dir or tmp
+        os.makedirs(directory, exist_ok=True)
+        for size in sizes:
+            for kind in kinds:
+                print(f"Generating {size} {kind} ratings...", file=sys.stderr)
+                movies_file, ratings_file = GENERATORS[kind](directory, size, seed=args.seed)
+                print(f"Comparing engines on {size} {kind} ratings...", file=sys.stderr)
+                results = run_differential(
+                    movies_file, ratings_file, args.queries, args.seed, args.workers
+                )
+                failed = failed or any(r["mismatches"] for r in results)
+                report["runs"].append({"ratings": size, "data": kind, "results": results})
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if failed:
+        print("Some engines disagree with the reference implementation.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,1704 @@
+import argparse
+import asyncio
+import bisect
+import bz2
+import cProfile
+import functools
+import glob
+import gzip
+import heapq
+import io
+import json
+import lzma
+import math
+import mmap
+import os
+import pstats
 import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
+from itertools import chain, islice
+from operator import itemgetter
 
 
-def load_movies_file(filename):
+SNAPSHOT_SUFFIX = ".snap"
+_SNAPSHOT_MAGIC = b"MRSNAP01"
+_RECS_MAGIC = b"MRRECS01"
+_RATINGS_COLUMNS = ("movie_idx", "rating", "user_id", "movie_sum", "movie_count")
+_ROW_COLUMNS = ("movie_idx", "rating", "user_id")  # one entry per rating row
+# Columns that must have equal lengths: one entry per rating row, one per movie
+_RATINGS_COLUMN_GROUPS = (("movie_idx", "rating", "user_id"), ("movie_sum", "movie_count"))
+_RECS_COLUMN_GROUPS = (("user_ids", "genre", "genre_avg"), ("movies", "scores"))
+_COMPRESSED_EXTENSIONS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+_COMPRESSED_MAGIC = ((b"\x1f\x8b", gzip.open), (b"BZh", bz2.open), (b"\xfd7zXZ\x00", lzma.open))
+_READ_BLOCK_SIZE = 1 << 20
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _PhaseTimer:
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation.record_phase(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _CallTimer:
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.stack = self.instrumentation._stack()
+        self.stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation.record_call(self.name, time.perf_counter() - self.start)
+        self.stack.pop()
+        return False
+
+
+class Instrumentation:
+    """
+    Opt-in call counters, wall-time totals and rows-scanned counts.
+
+    Disabled by default; every hook first checks `enabled`, so the only cost
+    when it is off is one attribute lookup per instrumented call or phase.
+    Per-function stats come from the @instrumented decorator, internal
+    phases (parse, normalise, aggregate, rank, render) from phase().
+
+    Queries may run on a thread pool, so while enabled every update and
+    as_dict()/report() hold a lock; the disabled path never takes it.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+            self.wall = {}
+            self.rows = {}
+            self.phase_calls = {}
+            self.phase_wall = {}
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def record_call(self, name, elapsed):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.wall[name] = self.wall.get(name, 0.0) + elapsed
+
+    def record_phase(self, name, elapsed):
+        with self._lock:
+            self.phase_calls[name] = self.phase_calls.get(name, 0) + 1
+            self.phase_wall[name] = self.phase_wall.get(name, 0.0) + elapsed
+
+    def add_rows(self, count):
+        """Attribute `count` scanned rows to the innermost instrumented call."""
+        if self.enabled:
+            stack = self._stack()
+            if stack:
+                with self._lock:
+                    self.rows[stack[-1]] = self.rows.get(stack[-1], 0) + count
+
+    def call(self, name):
+        """Context manager recording one call of `name`; a no-op when disabled."""
+        if not self.enabled:
+            return _NULL_PHASE
+        return _CallTimer(self, name)
+
+    def phase(self, name):
+        """Context manager timing one internal phase; a no-op when disabled."""
+        if not self.enabled:
+            return _NULL_PHASE
+        return _PhaseTimer(self, name)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "functions": {
+                    name: {
+                        "calls": self.calls[name],
+                        "wall_s": self.wall[name],
+                        "rows": self.rows.get(name, 0),
+                    }
+                    for name in self.calls
+                },
+                "phases": {
+                    name: {"calls": self.phase_calls[name], "wall_s": self.phase_wall[name]}
+                    for name in self.phase_calls
+                },
+            }
+
+    def report(self):
+        """Return a human-readable table of everything recorded so far."""
+        with self._lock:
+            return self._report()
+
+    def _report(self):
+        lines = ["=== Performance Report ==="]
+        if not self.enabled and not self.calls:
+            lines.append("Instrumentation is disabled (start with --profile to enable it).")
+            return "\n".join(lines)
+        lines.append(f"{'function':<28}{'calls':>8}{'wall (s)':>12}{'rows':>12}")
+        for name in sorted(self.calls, key=self.wall.get, reverse=True):
+            lines.append(
+                f"{name:<28}{self.calls[name]:>8}{self.wall[name]:>12.4f}"
+                f"{self.rows.get(name, 0):>12}"
+            )
+        lines.append(f"{'phase':<28}{'calls':>8}{'wall (s)':>12}")
+        for name in sorted(self.phase_calls, key=self.phase_wall.get, reverse=True):
+            lines.append(f"{name:<28}{self.phase_calls[name]:>8}{self.phase_wall[name]:>12.4f}")
+        return "\n".join(lines)
+
+
+INSTRUMENTATION = Instrumentation()
+
+
+def instrumented(func):
+    """Record calls, wall time and rows scanned for `func` while instrumentation is on."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not INSTRUMENTATION.enabled:
+            return func(*args, **kwargs)
+        with _CallTimer(INSTRUMENTATION, name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def profile_call(func, *args, **kwargs):
+    """Run one call under cProfile; return (result, top-25 cumulative stats text)."""
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    buf = io.StringIO()
+    pstats.Stats(profiler, stream=buf).sort_stats("cumulative").print_stats(25)
+    return result, buf.getvalue()
+
+
+def trace_memory_call(func, *args, **kwargs):
+    """Run one call under tracemalloc; return (result, peak bytes, top allocation sites)."""
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        top = [str(stat) for stat in tracemalloc.take_snapshot().statistics("lineno")[:10]]
+    finally:
+        if not already_tracing:
+            tracemalloc.stop()
+    return result, peak, top
+
+
+class QueryCache:
+    """
+    Bounded LRU cache of query results for the currently loaded dataset.
+
+    Entries are keyed by query name, parameters and the dataset version (the
+    catalog size and the ratings store's mutation counter). Seeing a different
+    movies or ratings object, or a newer ratings version after an ingest,
+    drops every entry, as does invalidate() after a menu reload.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._catalog = None
+        self._store = None
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self):
+        """Drop every cached result and forget the dataset they belong to."""
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        if self._entries:
+            self.invalidations += 1
+            self._entries.clear()
+        self._catalog = None
+        self._store = None
+        self._version = None
+
+    def _check_dataset(self, catalog, store):
+        if (
+            store is not self._store
+            or store.version != self._version
+            or (catalog is not None and self._catalog is not None and catalog is not self._catalog)
+        ):
+            self._clear()
+            self._store = store
+            self._version = store.version
+        if catalog is not None:
+            self._catalog = catalog
+
+    def get(self, name, params, catalog, store, compute):
+        """Return the cached result for this query, calling compute() on a miss."""
+        if self.maxsize <= 0:
+            return compute()
+        key = (name, params, len(catalog) if catalog is not None else None, store.version)
+        with self._lock:
+            self._check_dataset(catalog, store)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        result = compute()
+        with self._lock:
+            if store is self._store and store.version == key[3]:
+                self._entries[key] = result
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return result
+
+    def as_dict(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def report(self):
+        """Return a one-line summary of the cache counters."""
+        stats = self.as_dict()
+        return "Query cache: " + ", ".join(f"{name}={value}" for name, value in stats.items())
+
+
+QUERY_CACHE = QueryCache()
+
+
+class MovieCatalog(Mapping):
+    """
+    Movie catalog with names and genres interned to integer ids.
+
+    Reads like the original {'movie name': ('genre', 'id')} dictionary. Genres
+    are canonicalised once (stripped and lowercased) into genre ids, and a
+    lowercase-name table maps every movie to its genre id, so query functions
+    compare integers instead of lowercasing strings on every call.
+    """
+
+    def __init__(self):
+        self._movies = {}  # movie name -> (genre, movie id), as loaded
+        self.names = []  # catalog position -> movie name
+        self.movie_genre_ids = array("i")  # catalog position -> genre id
+        self._positions = {}  # movie name -> catalog position
+        self.genre_names = []  # genre id -> lowercase genre
+        self.genre_ids = {}  # lowercase genre -> genre id
+        # Lowercase movie name -> genre id of the case variant latest in catalog
+        # order, like the original {name.lower(): ...} comprehension over the dict
+        self.by_lower = {}
+        self._lower_last = {}  # lowercase movie name -> latest catalog position using it
+        self._genre_strings = {}  # shares one str object per distinct genre spelling
+
+    @classmethod
+    def from_dict(cls, movies):
+        """Build a catalog from a {'movie name': (genre, ...)} dict."""
+        catalog = cls()
+        for name, vals in movies.items():
+            catalog.add(name, vals[0], vals[1] if len(vals) > 1 else None)
+        return catalog
+
+    def add(self, name, genre, movie_id):
+        """Register (or redefine) one movie."""
+        genre = self._genre_strings.setdefault(genre, genre)
+        key = genre.strip().lower()
+        genre_id = self.genre_ids.get(key)
+        if genre_id is None:
+            genre_id = self.genre_ids[key] = len(self.genre_names)
+            self.genre_names.append(key)
+
+        key = name.lower()
+        pos = self._positions.get(name)
+        if pos is None:
+            pos = self._positions[name] = len(self.names)
+            self.names.append(name)
+            self.movie_genre_ids.append(genre_id)
+            self._lower_last[key] = pos
+        else:
+            # A redefinition keeps its catalog position, so it only decides the
+            # case-insensitive genre if no later name shares its lowercase form.
+            self.movie_genre_ids[pos] = genre_id
+        self._movies[name] = (genre, movie_id)
+        if self._lower_last[key] == pos:
+            self.by_lower[key] = genre_id
+
+    def genre_id(self, genre):
+        """Return the id of `genre` (any case), or None if no movie has it."""
+        return self.genre_ids.get(genre.strip().lower())
+
+    def as_dict(self):
+        return dict(self._movies)
+
+    def __getitem__(self, name):
+        return self._movies[name]
+
+    def __iter__(self):
+        return iter(self._movies)
+
+    def __len__(self):
+        return len(self._movies)
+
+    def __contains__(self, name):
+        return name in self._movies
+
+
+def as_movie_catalog(movies):
+    """Return `movies` as a MovieCatalog, converting plain dicts if needed."""
+    if isinstance(movies, MovieCatalog):
+        return movies
+    return MovieCatalog.from_dict(movies)
+
+
+def _compressed_opener(filename):
+    """Return gzip/bz2/lzma.open for a compressed file (by extension or magic bytes), else None."""
+    opener = _COMPRESSED_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+    if opener is not None:
+        return opener
+    with open(filename, "rb") as f:
+        head = f.read(6)
+    for magic, opener in _COMPRESSED_MAGIC:
+        if head.startswith(magic):
+            return opener
+    return None
+
+
+def _open_text(filename):
+    """Open a data file for reading as text, decompressing it on the fly if needed."""
+    opener = _compressed_opener(filename)
+    if opener is None:
+        return open(filename, "r")
+    return opener(filename, "rt")
+
+
+def _read_blocks(f, size=_READ_BLOCK_SIZE):
+    """
+    Yield the lines of text file `f` in lists read `size` characters at a time.
+
+    Lines lose their newline but split exactly where iterating over `f` would.
+    """
+    tail = ""
+    while True:
+        data = f.read(size)
+        if not data:
+            break
+        lines = (tail + data).split("\n")
+        tail = lines.pop()
+        if lines:
+            yield lines
+    if tail:
+        yield [tail]
+
+
+@instrumented
+def load_movies_file(filename, snapshot=False, errors=None):
+    """
+    Given a movies file, return a MovieCatalog that reads like a dictionary of
+    movies in the following format:
+    {'movie name': ('genre', 'id')}
+
+    With snapshot=True the parsed catalog is cached in a binary snapshot next
+    to the file and reused until the file's size or mtime changes. Files
+    compressed with gzip, bzip2 or xz are decompressed while reading.
+
+    Malformed lines are skipped silently, or counted in `errors` when a
+    LoadReport is given; the file is then always parsed, so the report is
+    complete even when a snapshot exists.
+    """
+    if snapshot and errors is None:
+        cached = _read_snapshot(filename)
+        if cached is not None:
+            meta, _, _ = cached
+            movies = MovieCatalog()
+            for name, genre, movie_id in meta["movies"]:
+                movies.add(name, genre, movie_id)
+            print(f"Loaded {len(movies)} movies from {filename}")
+            return movies
+
+    movies = MovieCatalog()
+    line_no = 0
+    before = errors.total() if errors is not None else 0
+    with INSTRUMENTATION.phase("parse"), _open_text(filename) as f:
+        for line_no, line in enumerate(chain.from_iterable(_read_blocks(f)), 1):
+            parts = line.strip().split("|")
+            if len(parts) != 3:
+                # print(f"⚠️ Skipping malformed line {line_no} in {filename}: {line.strip()}")
+                if errors is not None:
+                    errors.record("malformed", filename, line_no, line.strip(), line)
+                continue
+            genre, movie_id, name = parts
+            movies.add(name, genre, movie_id)
+    _print_load_report(errors, before, filename)
+    INSTRUMENTATION.add_rows(line_no)
+    if snapshot:
+        meta = {"movies": [[name, genre, movie_id] for name, (genre, movie_id) in movies.items()]}
+        _write_snapshot(filename, meta, {})
+    print(f"Loaded {len(movies)} movies from {filename}")
+    return movies
+
+
+def load_movies_files(filenames, duplicates="last", errors=None):
+    """
+    Load several movie catalogue files into one MovieCatalog, in order.
+
+    A movie name defined in more than one file is resolved by `duplicates`:
+    "last" (the default) keeps the definition from the later file, exactly as
+    a repeated line within one file does; "first" keeps the earliest one and
+    "error" raises ValueError. Either way the movie keeps the catalog position
+    of its first appearance, so tie-breaking follows the first file that
+    lists it. `errors` takes a LoadReport as in load_movies_file.
+    """
+    if duplicates not in ("first", "last", "error"):
+        raise ValueError(f"unknown duplicates policy: {duplicates!r}")
+    merged = MovieCatalog()
+    duplicate_count = 0
+    for filename in filenames:
+        catalog = load_movies_file(filename, errors=errors)
+        for name, (genre, movie_id) in catalog.items():
+            if name in merged:
+                duplicate_count += 1
+                if duplicates == "error":
+                    raise ValueError(f"movie {name!r} in {filename} is already defined")
+                if duplicates == "first":
+                    continue
+            merged.add(name, genre, movie_id)
+    print(
+        f"Loaded {len(merged)} movies from {len(filenames)} files "
+        f"({duplicate_count} duplicates, keeping {duplicates})"
+    )
+    return merged
+
+
+class RatingsStore(Mapping):
+    """
+    Compact, column-oriented ratings store.
+
+    Every rating is kept in three parallel typed arrays (movie index, rating,
+    user id) next to a movie-name catalog, so a row costs 20 bytes instead of
+    a tuple plus a boxed float and int. The store is also a read-only mapping
+    in the original format, so existing callers can keep using it as
+    {'movie name': [(rating, user_id), ...]}.
+    """
+
+    def __init__(self):
+        self.names = []  # movie index -> movie name
+        self.index = {}  # movie name -> movie index
+        self.movie_idx = array("i")
+        self.rating = array("d")
+        self.user_id = array("q")
+        # Running per-movie aggregates, indexed by movie index
+        self.movie_sum = array("d")
+        self.movie_count = array("q")
+        # Lowercase name -> first/last movie index using it, for case-insensitive joins
+        self.lower_first = {}
+        self.lower_last = {}
+        self.lower_rank = array("i")  # movie index -> lower_first of its lowercase name
+        self._genre_join = None  # (catalog, names joined, movie index -> genre id)
+        self._user_rows = None  # user id -> row indices, built on first use
+        self._movie_rows = None  # movie index -> row indices, built on first use
+        self._snapshot = None  # backing mmap while columns are zero-copy views
+        self.version = 0  # bumped on every mutation, for caches of derived data
+        self._item_index = None  # (version, k, ItemSimilarityIndex), built on demand
+        self._genre_index = None  # (catalog, version, genre id -> ranked movies)
+
+    @classmethod
+    def from_columns(cls, names, columns, snapshot=None):
+        """
+        Build a store around existing columns, e.g. memoryviews of a snapshot.
+
+        `columns` maps each name in _RATINGS_COLUMNS to an array or a typed
+        memoryview. Views are copied into arrays on the first write.
+        """
+        store = cls()
+        for name in names:
+            idx = store.index[name] = len(store.names)
+            store.names.append(name)
+            key = name.lower()
+            store.lower_rank.append(store.lower_first.setdefault(key, idx))
+            store.lower_last[key] = idx
+        for column in _RATINGS_COLUMNS:
+            setattr(store, column, columns[column])
+        store._snapshot = snapshot
+        return store
+
+    def _ensure_writable(self):
+        """Copy snapshot-backed columns into private arrays before mutating them."""
+        if self._snapshot is None:
+            return
+        for column in _RATINGS_COLUMNS:
+            view = getattr(self, column)
+            copy = array(view.format)
+            copy.frombytes(view.cast("B"))
+            setattr(self, column, copy)
+        self._snapshot = None
+
+    def view(self):
+        """Return a read-only RatingsView of the rows the store holds now."""
+        return RatingsView(self)
+
+    def copy(self):
+        """Return an independent copy of the rows and aggregates; caches are not copied."""
+        columns = {}
+        for column in _RATINGS_COLUMNS:
+            view = memoryview(getattr(self, column))
+            columns[column] = array(view.format)
+            columns[column].frombytes(view.cast("B"))
+        return type(self).from_columns(self.names, columns)
+
+    @classmethod
+    def from_dict(cls, ratings):
+        """Build a store from a {'movie name': [(rating, user_id), ...]} dict."""
+        store = cls()
+        for name, rating_list in ratings.items():
+            for rating, user_id in rating_list:
+                store.append(name, rating, user_id)
+        return store
+
+    def append(self, name, rating, user_id):
+        """
+        Add one rating row, registering the movie name if it is new.
+
+        The movie's running sum and count are updated in place, so the
+        aggregates never need a full recomputation.
+        """
+        self._ensure_writable()
+        self.version += 1
+        idx = self.movie_index(name)
+        self.movie_sum[idx] += rating
+        self.movie_count[idx] += 1
+        if self._user_rows is not None:
+            self._user_rows.setdefault(user_id, array("i")).append(len(self.rating))
+        if self._movie_rows is not None:
+            self._movie_rows.setdefault(idx, array("i")).append(len(self.rating))
+        self.movie_idx.append(idx)
+        self.rating.append(rating)
+        self.user_id.append(user_id)
+
+    def extend(self, names, movie_idx, rating, user_id):
+        """
+        Append a columnar batch of rows whose movie indices refer to `names`.
+
+        Used to merge partial stores (e.g. per-chunk parse results) without
+        rebuilding a tuple per row.
+        """
+        self._ensure_writable()
+        self.version += 1
+        remap = [self.movie_index(name) for name in names]
+        movie_idx = array("i", [remap[i] for i in movie_idx])
+        sums, counts = self.movie_sum, self.movie_count
+        for idx, value in zip(movie_idx, rating):
+            sums[idx] += value
+            counts[idx] += 1
+        if self._user_rows is not None:
+            for row, uid in enumerate(user_id, len(self.rating)):
+                self._user_rows.setdefault(uid, array("i")).append(row)
+        if self._movie_rows is not None:
+            for row, idx in enumerate(movie_idx, len(self.rating)):
+                self._movie_rows.setdefault(idx, array("i")).append(row)
+        self.movie_idx.extend(movie_idx)
+        self.rating.extend(rating)
+        self.user_id.extend(user_id)
+
+    def movie_index(self, name):
+        """Return the movie index for `name`, registering the name if it is new."""
+        idx = self.index.get(name)
+        if idx is None:
+            self._ensure_writable()
+            idx = self.index[name] = len(self.names)
+            self.names.append(name)
+            key = name.lower()
+            self.lower_rank.append(self.lower_first.setdefault(key, idx))
+            self.lower_last[key] = idx
+            self.movie_sum.append(0.0)
+            self.movie_count.append(0)
+        return idx
+
+    def rows(self):
+        """Number of rating rows held by the store."""
+        return len(self.rating)
+
+    def user_rows(self, user_id):
+        """
+        Return the row indices rated by `user_id`, in file order.
+
+        The per-user index is built with one pass over the store the first time
+        it is needed and kept up to date by append() afterwards, so later lookups
+        cost time proportional to the user's own history.
+        """
+        return self._user_index().get(user_id, ())
+
+    def user_ids(self):
+        """Return every user id in the store, in order of first rating."""
+        return list(self._user_index())
+
+    def _user_index(self):
+        if self._user_rows is None:
+            user_rows = {}
+            for row, uid in enumerate(self.user_id):
+                rows = user_rows.get(uid)
+                if rows is None:
+                    rows = user_rows[uid] = array("i")
+                rows.append(row)
+            self._user_rows = user_rows
+        return self._user_rows
+
+    def _movie_index_rows(self):
+        if self._movie_rows is None:
+            movie_rows = {}
+            for row, idx in enumerate(islice(self.movie_idx, self.rows())):
+                rows = movie_rows.get(idx)
+                if rows is None:
+                    rows = movie_rows[idx] = array("i")
+                rows.append(row)
+            self._movie_rows = movie_rows
+        return self._movie_rows
+
+    def user_movie_ratings(self, user_id):
+        """Return {movie index: [ratings]} for one user, in row order."""
+        rated = {}
+        movie_idx, rating = self.movie_idx, self.rating
+        for row in self.user_rows(user_id):
+            rated.setdefault(movie_idx[row], []).append(rating[row])
+        return rated
+
+    def item_similarity(self, k=20):
+        """Return an ItemSimilarityIndex for the current data, cached until the next write."""
+        cached = self._item_index
+        if cached is None or cached[0] != self.version or cached[1] != k:
+            cached = self._item_index = (self.version, k, ItemSimilarityIndex(self, k))
+        return cached[2]
+
+    def movie_average(self, idx):
+        """Return the average rating of one movie from its running sum and count."""
+        return self.movie_sum[idx] / self.movie_count[idx]
+
+    def movie_averages(self):
+        """Return the average rating of every movie, indexed by movie index."""
+        return [s / c for s, c in zip(self.movie_sum, self.movie_count)]
+
+    def as_dict(self):
+        """Return a plain dict copy in the original loader format."""
+        ratings = {name: [] for name in self.names}
+        names = self.names
+        rows = islice(zip(self.movie_idx, self.rating, self.user_id), self.rows())
+        for idx, rating, user_id in rows:
+            ratings[names[idx]].append((rating, user_id))
+        return ratings
+
+    def __getstate__(self):
+        # Snapshot views and the mmap cannot be pickled: ship plain arrays and
+        # let the receiving process rebuild the per-user index on demand.
+        state = self.__dict__.copy()
+        for column in _RATINGS_COLUMNS:
+            view = state[column]
+            if not isinstance(view, array):
+                state[column] = array(view.format)
+                state[column].frombytes(view.cast("B"))
+        state["_snapshot"] = None
+        state["_user_rows"] = None
+        state["_movie_rows"] = None
+        state["_item_index"] = None
+        state["_genre_join"] = None
+        state["_genre_index"] = None
+        return state
+
+    # Mapping interface: the dict-compatible view used by existing callers.
+
+    def __getitem__(self, name):
+        # Row indices per movie are built with one pass on first use (and kept
+        # up to date by append), so items()/values() stay linear in the rows.
+        idx = self.index[name]
+        rating, user_id = self.rating, self.user_id
+        return [(rating[row], user_id[row]) for row in self._movie_index_rows().get(idx, ())]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+
+class RatingsAggregates(RatingsStore):
+    """
+    Per-movie rating sums and counts without the rating rows themselves.
+
+    Memory grows with the number of movies rather than the number of ratings,
+    which is all the movie and genre rankings need. Anything that needs
+    individual ratings or users (user_preference, recommendations, the
+    mapping view) raises TypeError; load the file with load_ratings_file for
+    those.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._row_count = 0
+
+    def append(self, name, rating, user_id):
+        idx = self.movie_index(name)
+        self.movie_sum[idx] += rating
+        self.movie_count[idx] += 1
+        self._row_count += 1
+        self.version += 1
+
+    def extend(self, names, movie_idx, rating, user_id):
+        remap = [self.movie_index(name) for name in names]
+        sums, counts = self.movie_sum, self.movie_count
+        for i, value in zip(movie_idx, rating):
+            idx = remap[i]
+            sums[idx] += value
+            counts[idx] += 1
+        self._row_count += len(rating)
+        self.version += 1
+
+    def rows(self):
+        return self._row_count
+
+    def copy(self):
+        clone = super().copy()
+        clone._row_count = self._row_count
+        return clone
+
+    def _no_rows(self, *args, **kwargs):
+        raise TypeError(
+            "ratings were streamed as per-movie aggregates; "
+            "load them with load_ratings_file for per-rating or per-user queries"
+        )
+
+    def merge(self, names, movie_sum, movie_count):
+        """Add another partial's per-movie sums and counts, indexed by `names`."""
+        for name, total, count in zip(names, movie_sum, movie_count):
+            idx = self.movie_index(name)
+            self.movie_sum[idx] += total
+            self.movie_count[idx] += count
+            self._row_count += count
+        self.version += 1
+
+    user_rows = user_ids = user_movie_ratings = _no_rows
+    item_similarity = as_dict = __getitem__ = view = _no_rows
+
+
+class RatingsView(RatingsStore):
+    """
+    Read-only view of the first rows of a RatingsStore, as they were when
+    the view was made.
+
+    The store only ever appends to its rating columns and per-user row index,
+    so the view shares them and reads up to its row watermark; only the movie
+    names and per-movie aggregates, which appends change in place, are
+    copied. Making a view therefore costs O(movies), not O(ratings). Readers
+    in other threads may use a view while one writer appends to its store.
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store  # the writable store whose rows are shared
+        self._limit = store.rows()
+        self.names = list(store.names)
+        self.index = dict(store.index)
+        self.lower_first = dict(store.lower_first)
+        self.lower_last = dict(store.lower_last)
+        self.lower_rank = array("i", store.lower_rank)
+        self.movie_sum = array("d", store.movie_sum)
+        self.movie_count = array("q", store.movie_count)
+        self.movie_idx, self.rating, self.user_id = store.movie_idx, store.rating, store.user_id
+        # The store keeps its user index up to date on append; new users are
+        # added at the end, so the first _user_count keys are this view's users.
+        self._shared_user_rows = store._user_index()
+        self._user_count = len(self._shared_user_rows)
+        self._snapshot = store._snapshot
+        self.version = store.version
+
+    def _ensure_writable(self):
+        raise TypeError("RatingsView is read-only; append to its store instead")
+
+    def rows(self):
+        return self._limit
+
+    def user_rows(self, user_id):
+        rows = self._shared_user_rows.get(user_id)
+        if rows is None:
+            return ()
+        return rows[: bisect.bisect_left(rows, self._limit)]
+
+    def user_ids(self):
+        return list(islice(self._shared_user_rows, self._user_count))
+
+    def copy(self):
+        """Return a writable RatingsStore holding just the view's rows."""
+        return RatingsStore.from_columns(self.names, self._copy_columns())
+
+    def _copy_columns(self):
+        columns = {}
+        for column in _RATINGS_COLUMNS:
+            values = getattr(self, column)
+            # Slices, not memoryviews: an exported buffer would stop the store
+            # from growing the shared columns.
+            values = values[: self._limit] if column in _ROW_COLUMNS else values[:]
+            if not isinstance(values, array):
+                copy = array(values.format)
+                copy.frombytes(values.cast("B"))
+                values = copy
+            columns[column] = values
+        return columns
+
+    def __reduce__(self):
+        # Pickle (e.g. for a process pool) as a plain store of the visible rows
+        return RatingsStore.from_columns, (self.names, self._copy_columns())
+
+
+class ItemSimilarityIndex:
+    """
+    Sparse item-item similarity index for collaborative filtering.
+
+    Similarity is cosine over co-rating users (a user's repeated ratings of a
+    movie are averaged first), and only the top `k` neighbours of each movie
+    are kept. Building costs O(sum of squared user history lengths); users with
+    more than `max_user_items` movies only contribute their first ones. Scoring
+    a user then touches only the neighbours of the movies they rated, so it is
+    independent of catalogue size.
+    """
+
+    def __init__(self, store, k=20, max_user_items=500):
+        self.k = k
+        self.names = store.names
+        # movie index -> ((neighbour movie index, similarity), ...), best first
+        self.neighbours = [()] * len(store.names)
+        self._build(store, max_user_items)
+
+    def _build(self, store, max_user_items):
+        dots = [{} for _ in store.names]
+        norms = [0.0] * len(store.names)
+        for user_id in store.user_ids():
+            items = [
+                (idx, sum(values) / len(values))
+                for idx, values in store.user_movie_ratings(user_id).items()
+            ][:max_user_items]
+            for a, (i, r_i) in enumerate(items):
+                norms[i] += r_i * r_i
+                row_i = dots[i]
+                for j, r_j in items[a + 1 :]:
+                    product = r_i * r_j
+                    row_i[j] = row_i.get(j, 0.0) + product
+                    row_j = dots[j]
+                    row_j[i] = row_j.get(i, 0.0) + product
+
+        for i, row in enumerate(dots):
+            if not row:
+                continue
+            similarities = (
+                (j, dot / math.sqrt(norms[i] * norms[j])) for j, dot in row.items()
+            )
+            self.neighbours[i] = tuple(heapq.nlargest(self.k, similarities, key=itemgetter(1)))
+
+    def recommend(self, store, user_id, n=3):
+        """
+        Return the user's top N unrated (movie, score) pairs, where a movie's
+        score sums similarity * the user's rating over the rated movies it
+        neighbours.
+        """
+        rated = {
+            idx: sum(values) / len(values)
+            for idx, values in store.user_movie_ratings(user_id).items()
+        }
+        INSTRUMENTATION.add_rows(len(rated) * self.k)
+        scores = {}
+        for i, r_i in rated.items():
+            for j, similarity in self.neighbours[i]:
+                if j not in rated:
+                    scores[j] = scores.get(j, 0.0) + similarity * r_i
+        names = self.names
+        return rank_items(((names[j], score) for j, score in scores.items()), n)
+
+
+def as_ratings_store(ratings):
+    """Return `ratings` as a RatingsStore, converting plain dicts if needed."""
+    if isinstance(ratings, RatingsStore):
+        return ratings
+    return RatingsStore.from_dict(ratings)
+
+
+def _snapshot_path(filename):
+    return filename + SNAPSHOT_SUFFIX
+
+
+def _write_columns(path, magic, header, columns):
+    """
+    Write typed columns to a binary file that can be memory-mapped back.
+
+    Layout: `magic`, 8-byte header length, JSON header (`header` plus column
+    descriptors), then each column's raw bytes aligned to 8 bytes so it can be
+    cast in place after mmap. The file is replaced atomically.
+    """
+    descriptors = []
+    offset = 0
+    for name, column in columns.items():
+        nbytes = len(column) * column.itemsize
+        typecode = column.typecode if isinstance(column, array) else column.format
+        descriptors.append([name, typecode, offset, len(column)])
+        offset += nbytes + (-nbytes % 8)
+    header = json.dumps(dict(header, columns=descriptors)).encode("utf-8")
+    header += b" " * (-(len(magic) + 8 + len(header)) % 8)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(magic)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for column in columns.values():
+                data = column.tobytes()
+                f.write(data)
+                f.write(b"\0" * (-len(data) % 8))
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _map_columns(path, magic, groups=()):
+    """
+    Memory-map a file written by _write_columns; return (header, columns, mmap),
+    or None if it does not start with `magic`, its header is corrupt, a column
+    runs past the end of the file (e.g. a truncated write), or the columns in
+    one of `groups` (tuples of column names) are missing or differ in length.
+
+    Columns are typed memoryviews straight over the mmap; nothing is copied.
+    """
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    prefix = len(magic) + 8
+    if mm[: len(magic)] != magic:
+        return None
+    header_len = int.from_bytes(mm[len(magic) : prefix], "little")
+    if prefix + header_len > len(mm):
+        return None
+    try:
+        header = json.loads(mm[prefix : prefix + header_len])
+        descriptors = header["columns"]
+        data_start = prefix + header_len
+        view = memoryview(mm)
+        columns = {}
+        for name, typecode, offset, length in descriptors:
+            start = data_start + offset
+            nbytes = length * array(typecode).itemsize
+            if offset < 0 or length < 0 or start + nbytes > len(mm):
+                return None
+            columns[name] = view[start : start + nbytes].cast(typecode)
+    except (KeyError, TypeError, ValueError):
+        return None
+    for group in groups:
+        if any(name not in columns for name in group):
+            return None
+        if len({len(columns[name]) for name in group}) > 1:
+            return None
+    return header, columns, mm
+
+
+def _write_snapshot(filename, meta, columns):
+    """
+    Write a binary snapshot of parsed data next to `filename`, tagged with the
+    source size and mtime. Unwritable locations are skipped.
+    """
+    stat = os.stat(filename)
+    header = {
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "meta": meta,
+    }
+    try:
+        _write_columns(_snapshot_path(filename), _SNAPSHOT_MAGIC, header, columns)
+    except OSError:
+        pass
+
+
+def _read_snapshot(filename, groups=()):
+    """
+    Return (meta, columns, mmap) from the snapshot of `filename`, or None if it
+    is missing, unreadable, truncated or stale (source size or mtime changed).
+    `groups` is passed on to _map_columns.
+    """
+    try:
+        stat = os.stat(filename)
+        mapped = _map_columns(_snapshot_path(filename), _SNAPSHOT_MAGIC, groups)
+    except (OSError, ValueError):
+        return None
+    if mapped is None:
+        return None
+    header, columns, mm = mapped
+    if (
+        header.get("source_size") != stat.st_size
+        or header.get("source_mtime_ns") != stat.st_mtime_ns
+        or not isinstance(header.get("meta"), dict)
+    ):
+        return None
+    return header["meta"], columns, mm
+
+
+class LoadReport:
+    """
+    Bounded, aggregated record of the rows the loaders rejected.
+
+    Pass one as `errors=` to a loader instead of getting a printed warning per
+    bad row: rejected rows are counted per category ("malformed", "invalid"),
+    the first `max_examples` of each category are kept, and with `quarantine`
+    set every rejected line is written unchanged to that file, which is
+    emptied when the report is created so a clean load leaves it empty. The
+    loader prints one summary line; as_dict() is the structured summary. One
+    report can collect several loads; call close() to finish the quarantine
+    file.
+    """
+
+    def __init__(self, max_examples=5, quarantine=None):
+        self.max_examples = max_examples
+        self.quarantine = quarantine
+        self.counts = {}  # category -> rejected rows
+        self.examples = {}  # category -> first rejected rows, as dicts
+        self._quarantine_file = None
+        if quarantine is not None:
+            self._quarantine_file = open(quarantine, "w")
+
+    def record(self, kind, source, line_no, text, line):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        examples = self.examples.setdefault(kind, [])
+        if len(examples) < self.max_examples:
+            examples.append({"source": source, "line": line_no, "text": text})
+        if self.quarantine is not None:
+            if self._quarantine_file is None:
+                self._quarantine_file = open(self.quarantine, "a")  # reused after close()
+            self._quarantine_file.write(line.rstrip("\n") + "\n")
+
+    def add_count(self, kind, count):
+        """Count rejected rows whose details were dropped, e.g. by a worker process."""
+        self.counts[kind] = self.counts.get(kind, 0) + count
+
+    def handler(self, source):
+        """Return an on_error(kind, line_no, text, line) callback for rows of `source`."""
+        return lambda kind, line_no, text, line: self.record(kind, source, line_no, text, line)
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def flush(self):
+        if self._quarantine_file is not None:
+            self._quarantine_file.flush()
+
+    def close(self):
+        if self._quarantine_file is not None:
+            self._quarantine_file.close()
+            self._quarantine_file = None
+
+    def as_dict(self):
+        return {
+            "total": self.total(),
+            "counts": dict(self.counts),
+            "examples": {kind: list(rows) for kind, rows in self.examples.items()},
+            "quarantine": self.quarantine,
+        }
+
+
+class _ErrorCollector:
+    """
+    on_error callback for worker processes; the parent replays the rows.
+
+    With `limit`, only the first `limit` rows of each category are kept and
+    the rest are just counted, so a dirty chunk cannot flood the parent.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.rows = []
+        self.counts = {}
+
+    def __call__(self, kind, line_no, text, line):
+        count = self.counts[kind] = self.counts.get(kind, 0) + 1
+        if self.limit is None or count <= self.limit:
+            self.rows.append((kind, line_no, text, line))
+
+    def replay(self, on_error, report, line_offset=0):
+        kept = {}
+        for kind, line_no, text, line in self.rows:
+            on_error(kind, line_offset + line_no, text, line)
+            kept[kind] = kept.get(kind, 0) + 1
+        for kind, count in self.counts.items():
+            if count > kept.get(kind, 0):
+                report.add_count(kind, count - kept.get(kind, 0))
+
+
+def _worker_error_limit(report):
+    """Rows per category a worker must keep: all of them unless summarising only."""
+    if report is None or report.quarantine is not None:
+        return None
+    return report.max_examples
+
+
+def _error_handler(filename, report):
+    """Return the loaders' on_error callback: a warning per row, or `report` if given."""
+    if report is not None:
+        return report.handler(filename)
+    return lambda kind, line_no, text, line: print(
+        _ratings_warning(kind, filename, line_no, text)
+    )
+
+
+def _print_load_report(report, before, filename):
+    """Print one summary line for the rows `report` rejected from `filename`."""
+    if report is None:
+        return
+    report.flush()
+    skipped = report.total() - before
+    if skipped:
+        print(f"⚠️ Skipped {skipped} bad rows in {filename} (see the load report)")
+
+
+def _ratings_warning(kind, filename, line_no, text):
+    """Format the loader warning for a skipped ratings row."""
+    if kind == "malformed":
+        return f"⚠️ Skipping malformed line {line_no} in {filename}: {text}"
+    return f"⚠️ Skipping invalid rating on line {line_no}: {text}"
+
+
+def _parse_ratings_lines(lines, store, on_error, first_line=1):
+    """
+    Parse name|rating|user_id lines into `store`.
+
+    Bad rows are reported as on_error(kind, line_no, text, line) with line
+    numbers counted from `first_line`. Returns the number of lines read.
+    """
+    line_no = first_line - 1
+    for line_no, line in enumerate(lines, first_line):
+        parts = line.strip().split("|")
+        if len(parts) != 3:
+            on_error("malformed", line_no, line.strip(), line)
+            continue
+
+        name, rating, user_id = parts
+        try:
+            rating, user_id = float(rating), int(user_id)
+        except ValueError:
+            on_error("invalid", line_no, rating, line)
+            continue
+        store.append(name, rating, user_id)
+    return line_no - first_line + 1
+
+
+def _parse_ratings_blocks(blocks, store, on_error, first_line=1):
+    """
+    Parse lists of name|rating|user_id lines (see _read_blocks) into `store`.
+
+    For a freshly loaded RatingsStore each block is parsed in one tight loop
+    that appends straight to the columns, without a store.append() call per
+    row; other stores go through _parse_ratings_lines. Warnings and line
+    numbers are the same either way. Returns the number of lines read.
+    """
+    next_line = first_line
+    for lines in blocks:
+        line_no, next_line = next_line, next_line + len(lines)
+        if (
+            type(store) is not RatingsStore
+            or store._user_rows is not None
+            or store._movie_rows is not None
+        ):
+            _parse_ratings_lines(lines, store, on_error, line_no)
+            continue
+
+        store._ensure_writable()
+        store.version += 1
+        index, movie_index = store.index, store.movie_index
+        sums, counts = store.movie_sum, store.movie_count
+        append_idx = store.movie_idx.append
+        append_rating = store.rating.append
+        append_user = store.user_id.append
+        for line_no, line in enumerate(lines, line_no):
+            parts = line.strip().split("|")
+            if len(parts) != 3:
+                on_error("malformed", line_no, line.strip(), line)
+                continue
+
+            name, rating, user_id = parts
+            try:
+                rating, user_id = float(rating), int(user_id)
+            except ValueError:
+                on_error("invalid", line_no, rating, line)
+                continue
+            idx = index.get(name)
+            if idx is None:
+                idx = movie_index(name)
+            sums[idx] += rating
+            counts[idx] += 1
+            append_idx(idx)
+            append_rating(rating)
+            append_user(user_id)
+    return next_line - first_line
+
+
+def _chunk_boundaries(filename, chunks):
+    """Split a file into at most `chunks` byte ranges that start on line boundaries."""
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, "rb") as f:
+        for i in range(1, chunks):
+            pos = max(size * i // chunks, bounds[-1])
+            if pos == 0 or pos >= size:
+                continue
+            f.seek(pos - 1)
+            f.readline()
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _load_ratings_chunk(filename, start, end, error_limit=None):
+    """Process-pool worker: parse one byte range of a ratings file."""
+    with open(filename, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    store = RatingsStore()
+    errors = _ErrorCollector(error_limit)
+    line_count = _parse_ratings_blocks(
+        _read_blocks(io.TextIOWrapper(io.BytesIO(data))), store, errors
+    )
+    return store.names, store.movie_idx, store.rating, store.user_id, errors, line_count
+
+
+def _load_ratings_parallel(filename, workers, report=None):
+    """Parse a ratings file in newline-aligned chunks across a process pool."""
+    ratings = RatingsStore()
+    chunks = _chunk_boundaries(filename, workers * 4)
+    on_error = _error_handler(filename, report)
+    line_offset = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            _load_ratings_chunk,
+            [filename] * len(chunks),
+            [start for start, _ in chunks],
+            [end for _, end in chunks],
+            [_worker_error_limit(report)] * len(chunks),
+        )
+        # Merge in file order so movie order and line numbers match a serial load
+        for names, movie_idx, rating, user_id, errors, line_count in results:
+            errors.replay(on_error, report, line_offset)
+            ratings.extend(names, movie_idx, rating, user_id)
+            line_offset += line_count
+    return ratings
+
+
+@instrumented
+def load_ratings_file(filename, workers=1, snapshot=False, errors=None):
+    """
+    Given a ratings file, return a RatingsStore that reads like a dictionary of
+    ratings in the following format:
+    {'movie name': [('rating1', 'id1'), ('rating2', 'id2')]}
+    Skips malformed or non-numeric rows gracefully.
+
+    With workers > 1 (or None for one per CPU) the file is split into
+    newline-aligned chunks that are parsed in a process pool and merged back
+    in file order; the result and warnings are identical to a serial load.
+    Files compressed with gzip, bzip2 or xz (detected by extension or magic
+    bytes) are stream-decompressed and always parsed serially.
+
+    With snapshot=True the rating columns and per-movie aggregates are written
+    to a binary snapshot next to the file. Later loads memory-map it instead of
+    parsing, until the file's size or mtime changes. Warnings for skipped rows
+    are only printed when the text is actually parsed.
+
+    With errors=LoadReport(...) skipped rows are counted and sampled in the
+    report (and optionally quarantined) instead of printed one by one. The
+    text is then always parsed, since a snapshot does not keep skipped rows.
+    """
+    if snapshot and errors is None:
+        cached = _read_snapshot(filename, _RATINGS_COLUMN_GROUPS)
+        if cached is not None and len(cached[0]["names"]) != len(cached[1]["movie_sum"]):
+            cached = None  # aggregates do not cover every movie name: re-parse
+        if cached is not None:
+            meta, columns, mm = cached
+            ratings = RatingsStore.from_columns(meta["names"], columns, mm)
+            print(f"Loaded {len(ratings)} ratings from {filename}...")
+            return ratings
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and _compressed_opener(filename) is not None:
+        workers = 1  # a compressed stream cannot be split at byte offsets
+    before = errors.total() if errors is not None else 0
+    with INSTRUMENTATION.phase("parse"):
+        if workers > 1:
+            ratings = _load_ratings_parallel(filename, workers, errors)
+        else:
+            ratings = RatingsStore()
+            with _open_text(filename) as f:
+                _parse_ratings_blocks(
+                    _read_blocks(f), ratings, _error_handler(filename, errors)
+                )
+    _print_load_report(errors, before, filename)
+    INSTRUMENTATION.add_rows(ratings.rows())
+    if snapshot:
+        columns = {column: getattr(ratings, column) for column in _RATINGS_COLUMNS}
+        _write_snapshot(filename, {"names": ratings.names}, columns)
+
+    print(f"Loaded {len(ratings)} ratings from {filename}...")
+    return ratings
+
+
+def ratings_shards(source):
+    """
+    Return the ratings shard files named by `source`, in merge order.
+
+    `source` is a directory (every regular file in it except snapshots and
+    hidden files), a glob pattern, or a list of filenames kept in the given
+    order. Directory and glob matches are sorted by name.
+    """
+    if not isinstance(source, str):
+        return list(source)
+    if os.path.isdir(source):
+        shards = sorted(
+            path
+            for path in (os.path.join(source, name) for name in os.listdir(source))
+            if os.path.isfile(path)
+            and not os.path.basename(path).startswith(".")
+            and not path.endswith(SNAPSHOT_SUFFIX)
+        )
+    else:
+        shards = sorted(
+            path for path in glob.glob(source) if not path.endswith(SNAPSHOT_SUFFIX)
+        )
+    if not shards:
+        raise FileNotFoundError(f"no ratings shards match {source!r}")
+    return shards
+
+
+def _load_ratings_shard(filename, aggregates_only, error_limit=None):
+    """Process-pool worker: parse one whole shard into a partial store."""
+    store = RatingsAggregates() if aggregates_only else RatingsStore()
+    errors = _ErrorCollector(error_limit)
+    with _open_text(filename) as f:
+        _parse_ratings_blocks(_read_blocks(f), store, errors)
+    if aggregates_only:
+        return store.names, store.movie_sum, store.movie_count, errors
+    return store.names, store.movie_idx, store.rating, store.user_id, errors
+
+
+def load_ratings_shards(source, workers=None, aggregates_only=False, errors=None):
+    """
+    Load ratings partitioned across many files into one store.
+
+    Each shard from ratings_shards(source) is parsed in its own process (map)
+    and the partial results are merged in shard order (reduce), so the result
+    equals loading the shards concatenated into one file, warnings included
+    (reported against each shard's own file name and line numbers).
+
+    With aggregates_only=True each shard is reduced to per-movie sums and
+    counts before merging and a RatingsAggregates is returned; since sums are
+    then added shard by shard, averages can differ from a single-file load in
+    the last bits of precision. `errors` takes a LoadReport as in
+    load_ratings_file.
     """
-    Given a movies file, return dictionary of movies in the following format:
-    {'movie name': ('genre', 'id')}
+    shards = ratings_shards(source)
+    if workers is None:
+        workers = min(len(shards), os.cpu_count() or 1)
+    ratings = RatingsAggregates() if aggregates_only else RatingsStore()
+    limit = _worker_error_limit(errors)
+
+    with INSTRUMENTATION.phase("parse"):
+        if workers > 1 and len(shards) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(
+                    pool.map(
+                        _load_ratings_shard,
+                        shards,
+                        [aggregates_only] * len(shards),
+                        [limit] * len(shards),
+                    )
+                )
+        else:
+            results = [_load_ratings_shard(shard, aggregates_only, limit) for shard in shards]
+
+    before = errors.total() if errors is not None else 0
+    for shard, result in zip(shards, results):
+        *columns, shard_errors = result
+        shard_errors.replay(_error_handler(shard, errors), errors)
+        if aggregates_only:
+            ratings.merge(*columns)
+        else:
+            ratings.extend(*columns)
+    _print_load_report(errors, before, source if isinstance(source, str) else "shards")
+    INSTRUMENTATION.add_rows(ratings.rows())
+    print(f"Loaded {len(ratings)} ratings from {len(shards)} shards...")
+    return ratings
+
+
+def _is_sharded(source):
     """
-    movies = {}
-    with open(filename, "r") as f:
-        for line_no, line in enumerate(f, 1):
-            parts = line.strip().split("|")
-            if len(parts) != 3:
-                # print(f"⚠️ Skipping malformed line {line_no} in {filename}: {line.strip()}")
-                continue
-            genre, movie_id, name = parts
-            movies[name] = (genre, movie_id)
-    print(f"Loaded {len(movies)} movies from {filename}")
-    return movies
+    True if a ratings filename from the menu or CLI names a directory or glob
+    of shards. An existing file is never a glob, even if its name contains
+    glob characters such as ratings[2024].txt.
+    """
+    if os.path.isfile(source):
+        return False
+    return os.path.isdir(source) or any(ch in source for ch in "*?[")
 
 
-def load_ratings_file(filename):
+def stream_ratings_aggregates(filename, errors=None):
     """
-    Given a ratings file, return dictionary of ratings in the following format:
-    {'movie name': [('rating1', 'id1'), ('rating2', 'id2')]}
-    Skips malformed or non-numeric rows gracefully.
+    Read a ratings file in a single streaming pass, keeping only per-movie sums
+    and counts, and return them as RatingsAggregates.
+
+    Lines are parsed one at a time straight from the file into the running
+    aggregates, so files larger than memory can still be ranked with
+    movie_popularity, movie_popularity_in_genre and genre_popularity. Results,
+    warnings and `errors` reporting match load_ratings_file.
     """
-    ratings = {}
-    with open(filename, "r") as f:
-        for line_no, line in enumerate(f, 1):
-            parts = line.strip().split("|")
-            if len(parts) != 3:
-                print(
-                    f"⚠️ Skipping malformed line {line_no} in {filename}: {line.strip()}"
-                )
-                continue
+    aggregates = RatingsAggregates()
+    before = errors.total() if errors is not None else 0
+    with INSTRUMENTATION.phase("parse"):
+        with _open_text(filename) as f:
+            _parse_ratings_blocks(
+                _read_blocks(f), aggregates, _error_handler(filename, errors)
+            )
+    _print_load_report(errors, before, filename)
+    INSTRUMENTATION.add_rows(aggregates.rows())
+    print(f"Loaded {len(aggregates)} ratings from {filename}...")
+    return aggregates
 
-            name, rating, user_id = parts
-            try:
-                ratings.setdefault(name, []).append((float(rating), int(user_id)))
-            except ValueError:
-                print(f"⚠️ Skipping invalid rating on line {line_no}: {rating}")
-                continue
 
-    print(f"Loaded {len(ratings)} ratings from {filename}...")
-    return ratings
+def load_movies_source(source, errors=None):
+    """
+    Load the movies named on the CLI or by the server: one file (with a
+    snapshot), or several comma-separated catalogues merged by
+    load_movies_files.
+    """
+    if "," in source and not os.path.isfile(source):
+        return load_movies_files([name.strip() for name in source.split(",")], errors=errors)
+    return load_movies_file(source, snapshot=True, errors=errors)
+
+
+def load_ratings_source(source, workers=1, stream=False, errors=None):
+    """
+    Load the ratings named on the CLI or by the server: a directory or glob of
+    shards, or one file (with a snapshot). With stream=True only per-movie
+    aggregates are kept.
+    """
+    if _is_sharded(source):
+        return load_ratings_shards(source, workers, aggregates_only=stream, errors=errors)
+    if stream:
+        return stream_ratings_aggregates(source, errors=errors)
+    return load_ratings_file(source, workers=workers, snapshot=True, errors=errors)
+
+
+def ingest_ratings_rows(ratings, rows, source="<ingest>"):
+    """
+    Append new name|rating|user_id rows to a loaded RatingsStore in place.
+
+    Per-movie aggregates and the per-user index are updated row by row, so the
+    next query sees the new ratings without a reload. Bad rows are skipped with
+    the usual loader warnings. Returns the number of rows applied.
+    """
+    if not isinstance(ratings, RatingsStore):
+        raise TypeError("ratings must be a RatingsStore returned by load_ratings_file")
+    before = ratings.rows()
+    _parse_ratings_lines(
+        rows,
+        ratings,
+        _error_handler(source, None),
+    )
+    return ratings.rows() - before
+
+
+class RatingsTail:
+    """
+    Follows an append-only ratings file and feeds new rows into a RatingsStore.
+
+    The tail remembers the byte offset it has consumed; each poll() parses only
+    complete lines written since, and keeps a trailing partial line for the
+    next poll. Create it right after load_ratings_file (the default offset is
+    the current end of the file) and call poll() whenever fresh data is wanted.
+    """
+
+    def __init__(self, filename, offset=None, line_no=None):
+        self.filename = filename
+        self.offset = os.path.getsize(filename) if offset is None else offset
+        self.line_no = line_no  # lines consumed so far, for warning messages
+        if self.line_no is None:
+            # Count in blocks: the file may be far larger than memory
+            self.line_no = 0
+            remaining = self.offset
+            with open(filename, "rb") as f:
+                while remaining > 0:
+                    block = f.read(min(remaining, _READ_BLOCK_SIZE))
+                    if not block:
+                        break
+                    self.line_no += block.count(b"\n")
+                    remaining -= len(block)
+
+    def poll(self, ratings):
+        """Apply rows appended since the last poll; returns the number of rows applied."""
+        if not isinstance(ratings, RatingsStore):
+            raise TypeError("ratings must be a RatingsStore returned by load_ratings_file")
+        size = os.path.getsize(self.filename)
+        if size < self.offset:
+            raise ValueError(f"{self.filename} shrank; reload it instead of tailing")
+        if size == self.offset:
+            return 0
+
+        with open(self.filename, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return 0  # only a partial line so far
+
+        before = ratings.rows()
+        self.line_no += _parse_ratings_lines(
+            io.TextIOWrapper(io.BytesIO(data[:end])),
+            ratings,
+            _error_handler(self.filename, None),
+            first_line=self.line_no + 1,
+        )
+        self.offset += end
+        return ratings.rows() - before
+
+
+def rank_items(items, n, offset=0):
+    """
+    Return the `offset`..`offset + n` slice of (key, score) pairs ranked by
+    descending score.
+
+    Uses partial selection (heapq.nlargest) rather than a full sort, so ranking
+    M items costs O(M log(offset + n)). Ties keep their input order, exactly as
+    a stable sort would, and `n` is clamped to the number of items available.
+    """
+    n, offset = max(n, 0), max(offset, 0)
+    with INSTRUMENTATION.phase("rank"):
+        return heapq.nlargest(offset + n, items, key=itemgetter(1))[offset:]
+
+
+def _cached_query(name, params, movies, ratings, compute):
+    """Answer through QUERY_CACHE when the inputs are loaded objects; plain dicts bypass it."""
+    if not isinstance(ratings, RatingsStore) or not (
+        movies is None or isinstance(movies, MovieCatalog)
+    ):
+        return compute()
+    return QUERY_CACHE.get(name, params, movies, ratings, compute)
+
+
+def top_movies(ratings, n, offset=0):
+    """Return the top N (movie, average rating) pairs across all movies."""
+    store = as_ratings_store(ratings)
+    INSTRUMENTATION.add_rows(len(store))
+    with INSTRUMENTATION.phase("aggregate"):
+        averages = store.movie_averages()
+    return rank_items(zip(store.names, averages), n, offset)
+
+
+def top_movies_in_genre(movies, ratings, genre, n, offset=0):
+    """Return the top N (movie, average rating) pairs within one genre."""
+    catalog = as_movie_catalog(movies)
+    store = as_ratings_store(ratings)
+    ranked = _genre_index(catalog, store).get(catalog.genre_id(genre), [])
+    top_n = _page(ranked, n, offset)
+    INSTRUMENTATION.add_rows(len(top_n))
+    return top_n
+
+
+def top_genres(movies, ratings, n, offset=0):
+    """Return the top N (genre, average movie rating) pairs, genres title-cased."""
+    catalog = as_movie_catalog(movies)
+    store = as_ratings_store(ratings)
+    INSTRUMENTATION.add_rows(len(store))
+    movie_genres = _movie_genres(catalog, store)
 
+    with INSTRUMENTATION.phase("aggregate"):
+        # Aggregate movie averages by genre id. Names were matched
+        # case-insensitively at load time, one movie per lowercase name.
+        genre_totals = {}
+        genre_counts = {}
+        for idx in store.lower_last.values():
+            genre_id = movie_genres[idx]
+            if genre_id is not None:
+                avg = store.movie_average(idx)
+                genre_totals[genre_id] = genre_totals.get(genre_id, 0) + avg
+                genre_counts[genre_id] = genre_counts.get(genre_id, 0) + 1
 
+        # Calculate average rating per genre
+        genre_avg = {g: genre_totals[g] / genre_counts[g] for g in genre_totals}
+    names = catalog.genre_names
+    return [(names[g].title(), avg) for g, avg in rank_items(genre_avg.items(), n, offset)]
+
+
+@instrumented
 def movie_popularity(ratings, n):
     """
     Calculate and display the top N movies ranked by their average rating.
 
     Each movie's average rating is calculated by taking the mean of all its user ratings.
     The movies are then sorted in descending order of their average rating, and the top N
-    movies are printed.
-    """
-    averages = {}
-    for movie in ratings:
-        just_ratings = [r for r, u in ratings[movie]]
-        avg = sum(just_ratings) / len(just_ratings)
-        averages[movie] = avg
-    sorted_averages = dict(
-        sorted(averages.items(), key=lambda item: item[1], reverse=True)
+    movies are printed. N larger than the number of movies prints all of them.
+    """
+    top_n = _cached_query(
+        "movie_popularity", (n,), None, ratings, lambda: top_movies(ratings, n)
     )
-    sorted_movies = list(sorted_averages.keys())
-    print("\n")
-    print(f"Here are the top {n} movies:")
-    for i in range(n):
-        print(sorted_movies[i])
+    with INSTRUMENTATION.phase("render"):
+        print("\n")
+        print(f"Here are the top {n} movies:")
+        for movie, _ in top_n:
+            print(movie)
 
 
+@instrumented
 def movie_popularity_in_genre(movies, ratings, genre, n):
     """
     Calculate and display the top N movies within a specific genre ranked by their average rating.
@@ -77,19 +1707,20 @@ def movie_popularity_in_genre(movies, ratings, genre, n):
     based on user ratings. The results are then sorted from highest to lowest average rating, 
     and the top N movies are printed.
     """
-    movie_scores = {}
-    for movie_name, (movie_genre, movie_id) in movies.items():
-        if movie_genre.lower() == genre.lower():
-            if movie_name in ratings:
-                scores = [r for r, _ in ratings[movie_name]]
-                avg = sum(scores) / len(scores)
-                movie_scores[movie_name] = avg
-    sorted_movies = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
-    top_n = sorted_movies[:n]
-    print(f"\nTop {n} {genre} movies (by average rating)")
-    for movie, avg in top_n:
-        print(f"{movie}: {avg:.2f}")
+    top_n = _cached_query(
+        "movie_popularity_in_genre",
+        (genre.strip().lower(), n),
+        movies,
+        ratings,
+        lambda: top_movies_in_genre(movies, ratings, genre, n),
+    )
+    with INSTRUMENTATION.phase("render"):
+        print(f"\nTop {n} {genre} movies (by average rating)")
+        for movie, avg in top_n:
+            print(f"{movie}: {avg:.2f}")
 
+
+@instrumented
 def genre_popularity(movies, ratings, n):
     """
     Calculate and return the top N genres by average movie rating (case-insensitive).
@@ -102,8 +1733,8 @@ def genre_popularity(movies, ratings, n):
         movies (dict): Dictionary where keys are movie names (any case) and values are tuples/lists.
                        The first element in the tuple/list should be the genre of the movie.
                        Example: {"Inception": ("Sci-Fi", 2010)}
-        ratings (dict): Dictionary where keys are movie names (any case) and values are lists of tuples,
-                        each containing a rating and a user ID.
+        ratings (dict or RatingsStore): Dictionary where keys are movie names (any case) and values
+                        are lists of tuples, each containing a rating and a user ID.
                         Example: {"Inception": [(5, 101), (4, 102)]}
         n (int): Number of top genres to return.
 
@@ -116,36 +1747,105 @@ def genre_popularity(movies, ratings, n):
         Top N genres by average rating with two decimal places.
     """
 
-    # Normalize movie names and genres to lowercase for matching
-    movies_lower = {name.lower(): (vals[0].strip().lower(), *vals[1:]) for name, vals in movies.items()}
-    ratings_lower = {name.lower(): val for name, val in ratings.items()}
+    top_n = _cached_query(
+        "genre_popularity", (n,), movies, ratings, lambda: top_genres(movies, ratings, n)
+    )
+
+    with INSTRUMENTATION.phase("render"):
+        print(f"\nTop {n} genres by average rating:")
+        for genre, avg in top_n:
+            print(f"{genre}: {avg:.2f}")
+
+    return list(top_n)
+
+def _movie_genres(catalog, store):
+    """
+    Map every movie index in `store` to its genre id in `catalog`.
+
+    Names are matched case-insensitively; when several rated names share a
+    lowercase form only the last one is matched, and unmatched movies map to
+    None. The join is cached on the store until new movie names appear.
+    """
+    cached = store._genre_join
+    if cached is not None and cached[0] is catalog and cached[1] == len(store.names):
+        return cached[2]
+    with INSTRUMENTATION.phase("normalise"):
+        genres = [None] * len(store.names)
+        by_lower = catalog.by_lower
+        for movie_name, idx in store.lower_last.items():
+            genres[idx] = by_lower.get(movie_name)
+    store._genre_join = (catalog, len(store.names), genres)
+    return genres
+
 
-    # Calculate average rating per movie
-    movie_avg = {}
-    for movie_name, rating_list in ratings_lower.items():
-        avg = sum(r for r, _ in rating_list) / len(rating_list)
-        movie_avg[movie_name] = avg
+def _user_genre_averages(catalog, store, movie_genres, user_id):
+    """Return {lowercase genre: average of the user's per-movie ratings}."""
+    # Visit the user's movies in first-seen name order so ties break the same
+    # way as a scan over the whole ratings dict.
+    INSTRUMENTATION.add_rows(len(store.user_rows(user_id)))
+    user_movies = []
+    for idx, user_ratings in store.user_movie_ratings(user_id).items():
+        genre_id = movie_genres[idx]
+        if genre_id is not None:
+            user_movies.append((store.lower_rank[idx], genre_id, user_ratings))
+    user_movies.sort(key=itemgetter(0))
 
-    # Aggregate ratings by genre
     genre_totals = {}
     genre_counts = {}
-    for movie_name, avg in movie_avg.items():
-        if movie_name in movies_lower:
-            genre = movies_lower[movie_name][0]
-            genre_totals[genre] = genre_totals.get(genre, 0) + avg
-            genre_counts[genre] = genre_counts.get(genre, 0) + 1
+    for _, genre_id, user_ratings in user_movies:
+        avg_user_rating = sum(user_ratings) / len(user_ratings)
+        genre_totals[genre_id] = genre_totals.get(genre_id, 0) + avg_user_rating
+        genre_counts[genre_id] = genre_counts.get(genre_id, 0) + 1
+
+    # Calculate average rating per genre for this user
+    names = catalog.genre_names
+    return {names[g]: genre_totals[g] / genre_counts[g] for g in genre_totals}
+
 
-    # Calculate average rating per genre
-    genre_avg = {g: genre_totals[g] / genre_counts[g] for g in genre_totals}
-    sorted_genres = sorted(genre_avg.items(), key=lambda x: x[1], reverse=True)
+def _genre_index(catalog, store):
+    """
+    Return {genre id: [(movie, avg), ...]} with every rated movie of each genre
+    ranked by average rating, ties in catalog order.
+
+    Built with one pass over the catalog and cached on the store until the
+    ratings change, so "top N in genre" is a slice and recommendations walk a
+    ready-made list.
+    """
+    cached = store._genre_index
+    if cached is not None and cached[0] is catalog and cached[1] == store.version:
+        return cached[2]
+    with INSTRUMENTATION.phase("aggregate"):
+        genre_scores = {}
+        index = store.index
+        for movie_name, genre_id in zip(catalog.names, catalog.movie_genre_ids):
+            idx = index.get(movie_name)
+            if idx is not None:
+                genre_scores.setdefault(genre_id, []).append(
+                    (movie_name, store.movie_average(idx))
+                )
+    with INSTRUMENTATION.phase("rank"):
+        ranked = {
+            genre_id: sorted(scores, key=itemgetter(1), reverse=True)
+            for genre_id, scores in genre_scores.items()
+        }
+    store._genre_index = (catalog, store.version, ranked)
+    return ranked
 
-    print(f"\nTop {n} genres by average rating:")
-    for genre, avg in sorted_genres[:n]:
-        print(f"{genre.title()}: {avg:.2f}")
 
-    # Return top N genres with proper capitalization
-    return [(genre.title(), avg) for genre, avg in sorted_genres[:n]]
+def _top_unrated(ranked, rated_movies, k):
+    """Walk a ranked (movie, avg) list and return the first `k` movies not in `rated_movies`."""
+    k = max(k, 0)
+    top_recs = []
+    for movie, avg in ranked:
+        if len(top_recs) == k:
+            break
+        if movie not in rated_movies:
+            top_recs.append((movie, avg))
+    INSTRUMENTATION.add_rows(len(top_recs) + len(rated_movies))
+    return top_recs
 
+
+@instrumented
 def user_preference(movies, ratings, user_id):
     """
     Determine a user's preferred genre based on their ratings (case-insensitive).
@@ -158,8 +1858,8 @@ def user_preference(movies, ratings, user_id):
         movies (dict): Dictionary where keys are movie names (any case) and values are tuples/lists.
                        The first element in the tuple/list should be the genre of the movie.
                        Example: {"Inception": ("Sci-Fi", 2010)}
-        ratings (dict): Dictionary where keys are movie names (any case) and values are lists of tuples,
-                        each containing a rating and a user ID.
+        ratings (dict or RatingsStore): Dictionary where keys are movie names (any case) and values
+                        are lists of tuples, each containing a rating and a user ID.
                         Example: {"Inception": [(5, 101), (4, 102)]}
         user_id (int): The ID of the user whose preferred genre is being calculated.
 
@@ -171,79 +1871,921 @@ def user_preference(movies, ratings, user_id):
         The user's preferred genre along with its average rating.
     """
 
-    # Normalize movie names and genres to lowercase for matching
-    movies_lower = {name.lower(): (vals[0].strip().lower(), *vals[1:]) for name, vals in movies.items()}
-    ratings_lower = {name.lower(): val for name, val in ratings.items()}
-
-    genre_totals = {}
-    genre_counts = {}
-
-    for movie_name, rating_list in ratings_lower.items():
-        if movie_name not in movies_lower:
-            continue
+    preference = _cached_query(
+        "user_preference",
+        (user_id,),
+        movies,
+        ratings,
+        lambda: _preferred_genre(movies, ratings, user_id),
+    )
 
-        # Find ratings by this specific user
-        user_ratings = [r for r, uid in rating_list if uid == user_id]
+    return _show_preference(user_id, preference)
 
-        if user_ratings:
-            avg_user_rating = sum(user_ratings) / len(user_ratings)
-            genre = movies_lower[movie_name][0]
-            genre_totals[genre] = genre_totals.get(genre, 0) + avg_user_rating
-            genre_counts[genre] = genre_counts.get(genre, 0) + 1
 
-    if not genre_totals:
+def _show_preference(user_id, preference):
+    """Print a (genre, average) preference, or None, the way user_preference does."""
+    if preference is None:
         print(f"User {user_id} has not rated any movies in the database.")
         return None
 
-    # Calculate average rating per genre for this user
-    genre_avg = {g: genre_totals[g] / genre_counts[g] for g in genre_totals}
-    preferred_genre = max(genre_avg.items(), key=lambda x: x[1])[0]
+    preferred_genre, avg = preference
 
-    print(f"User {user_id}'s preferred genre is: {preferred_genre.title()} "
-          f"(average rating: {genre_avg[preferred_genre]:.2f})")
+    with INSTRUMENTATION.phase("render"):
+        print(f"User {user_id}'s preferred genre is: {preferred_genre.title()} "
+              f"(average rating: {avg:.2f})")
 
     return preferred_genre.title()
 
-def recommend_movies(user_id, movies, ratings):
+
+def _preferred_genre(movies, ratings, user_id):
+    """Return (lowercase genre, average) for the user's best genre, or None."""
+    catalog = as_movie_catalog(movies)
+    store = as_ratings_store(ratings)
+    genre_avg = _user_genre_averages(catalog, store, _movie_genres(catalog, store), user_id)
+    if not genre_avg:
+        return None
+    return max(genre_avg.items(), key=lambda x: x[1])
+
+@instrumented
+def recommend_movies(user_id, movies, ratings, engine="genre", table=None):
     """
     Recommend 3 most popular movies from the user's top genre
     that the user has not yet rated.
+
+    engine="item" instead recommends the 3 unrated movies most similar to the
+    ones the user rated, using the store's ItemSimilarityIndex.
+
+    With a RecommendationTable that is up to date with `movies` and
+    `ratings`, the genre recommendation is read from the table instead of
+    being recomputed.
     """
     if not movies or not ratings:
         print("Please load movies and ratings data first.")
         return
 
-    preferred_genre = user_preference(movies, ratings, int(user_id))
+    store = as_ratings_store(ratings)
+    if engine == "item":
+        top_recs = store.item_similarity().recommend(store, int(user_id), 3)
+        with INSTRUMENTATION.phase("render"):
+            print(f"\nTop 3 recommended movies for User {user_id} (item-item similarity):")
+            if not top_recs:
+                print("No similar unrated movies found.")
+                return
+            for movie, score in top_recs:
+                print(f"{movie}: {score:.2f}")
+        return
+    if engine != "genre":
+        raise ValueError(f"unknown recommendation engine: {engine!r}")
+    catalog = as_movie_catalog(movies)
+    entry = None
+    if table is not None and table.k >= 3 and table.serves(catalog, store):
+        entry = table.entry(int(user_id))
+    if entry is not None:
+        genre, avg, top_recs = entry
+        preferred_genre = _show_preference(user_id, (genre, avg) if genre else None)
+        top_recs = top_recs[:3]
+    else:
+        preferred_genre = user_preference(catalog, store, int(user_id))
     if not preferred_genre:
         print("Cannot determine preferred genre — user may not have rated any movies.")
         return
 
-    genre_movies = {
-        name: (genre, mid)
-        for name, (genre, mid) in movies.items()
-        if genre.lower() == preferred_genre.lower()
+    if entry is None:
+        rated_movies = {
+            store.names[idx] for idx in store.user_movie_ratings(int(user_id))
+        }
+        ranked = _genre_index(catalog, store).get(catalog.genre_id(preferred_genre), [])
+        top_recs = _top_unrated(ranked, rated_movies, 3)
+    with INSTRUMENTATION.phase("render"):
+        print(f"\nTop 3 recommended movies for User {user_id} (Genre: {preferred_genre}):")
+        if not top_recs:
+            print("No unrated movies available in your top genre.")
+            return
+
+        for movie, avg in top_recs:
+            print(f"{movie}: {avg:.2f}")
+
+
+def _user_recommendation(catalog, store, movie_genres, genre_index, user_id, k):
+    """
+    Return (preferred genre, its average, top-k unrated (movie, avg) pairs) for
+    one user, or (None, 0.0, []) if the user has not rated any known movie.
+    """
+    genre_avg = _user_genre_averages(catalog, store, movie_genres, user_id)
+    if not genre_avg:
+        return None, 0.0, []
+    preferred_genre, avg = max(genre_avg.items(), key=itemgetter(1))
+    ranked = genre_index.get(catalog.genre_id(preferred_genre), [])
+    rated_movies = {store.names[idx] for idx in store.user_movie_ratings(user_id)}
+    return preferred_genre.title(), avg, _top_unrated(ranked, rated_movies, k)
+
+
+def _recommend_for_user(catalog, store, movie_genres, genre_index, user_id, k):
+    """
+    Return (preferred genre, top-k unrated (movie, avg) pairs) for one user, or
+    (None, []) if the user has not rated any known movie.
+    """
+    genre, _, recs = _user_recommendation(
+        catalog, store, movie_genres, genre_index, user_id, k
+    )
+    return genre, recs
+
+
+def _recommend_users(catalog, store, user_ids, k):
+    """Compute {user_id: top-k recommendations} for one shard of users."""
+    movie_genres = _movie_genres(catalog, store)
+    genre_index = _genre_index(catalog, store)
+    return {
+        user_id: _recommend_for_user(
+            catalog, store, movie_genres, genre_index, user_id, k
+        )[1]
+        for user_id in user_ids
     }
-    rated_movies = set()
-    for movie_name, rating_list in ratings.items():
-        for _, uid in rating_list:
-            if uid == int(user_id):
-                rated_movies.add(movie_name)
-
-    movie_scores = {}
-    for movie_name, (genre, mid) in genre_movies.items():
-        if movie_name not in rated_movies and movie_name in ratings:
-            scores = [r for r, _ in ratings[movie_name]]
-            avg = sum(scores) / len(scores)
-            movie_scores[movie_name] = avg
-
-    sorted_recs = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
-    print(f"\nTop 3 recommended movies for User {user_id} (Genre: {preferred_genre}):")
-    if not sorted_recs:
-        print("No unrated movies available in your top genre.")
-        return
 
-    for movie, avg in sorted_recs[:3]:
-        print(f"{movie}: {avg:.2f}")
+
+def recommend_movies_batch(movies, ratings, user_ids=None, k=3, workers=1):
+    """
+    Recommend movies for many users at once.
+
+    Returns {user_id: [(movie, avg), ...]} holding, for each user, the same top
+    `k` unrated movies from their preferred genre that recommend_movies would
+    print; users without any rated movies map to an empty list. `user_ids`
+    defaults to every user in the ratings.
+
+    The movie -> genre join, the per-user index and the ranked genre index are
+    built once and shared by every user in the batch. With workers > 1 users are sharded across a process pool.
+    """
+    catalog = as_movie_catalog(movies)
+    store = as_ratings_store(ratings)
+    if user_ids is None:
+        user_ids = store.user_ids()
+    user_ids = [int(user_id) for user_id in user_ids]
+
+    if workers <= 1 or len(user_ids) < 2:
+        return _recommend_users(catalog, store, user_ids, k)
+
+    shards = [user_ids[i::workers] for i in range(workers)]
+    partials = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_recommend_users, catalog, store, shard, k)
+            for shard in shards
+            if shard
+        ]
+        for future in futures:
+            partials.update(future.result())
+    return {user_id: partials[user_id] for user_id in user_ids}
+
+
+def _catalog_fingerprint(catalog):
+    """CRC of every (name, genre) pair, to notice a table built from another catalog."""
+    crc = 0
+    for name, genre_id in zip(catalog.names, catalog.movie_genre_ids):
+        crc = zlib.crc32(f"{name}|{genre_id}\n".encode("utf-8"), crc)
+    return crc
+
+
+def _ratings_fingerprint(store, rows):
+    """CRC of the first `rows` rating rows, to check a store extends the one a table saw."""
+    # Hashed in sliced blocks rather than through a memoryview, which would
+    # stop the store from appending while a RatingsView is being checked.
+    crc = 0
+    block = _READ_BLOCK_SIZE // 8
+    for column in (store.movie_idx, store.rating, store.user_id):
+        for start in range(0, rows, block):
+            crc = zlib.crc32(column[start : min(start + block, rows)], crc)
+    return crc
+
+
+class RecommendationTable:
+    """
+    Materialised genre recommendations: every user's preferred genre and
+    top-k unrated movies, computed once so serving them is a lookup.
+
+    Rows live in compact typed columns sorted by user id (user id, genre and
+    its average, then k movie/score slots per user), so a saved table is memory-mapped on
+    open and searched by bisection without parsing anything. update() only
+    recomputes users affected by ratings appended since the table was built.
+    """
+
+    def __init__(self, k, rows, names, genres, columns, fingerprints, mm=None):
+        self.k = k
+        self.rows = rows  # rating rows the table reflects
+        self.names = names  # movie index -> movie name
+        self.genres = genres  # genre slot -> title-cased genre
+        self.user_ids = columns["user_ids"]  # sorted
+        self.genre = columns["genre"]  # user row -> genre slot, -1 if none
+        self.genre_avg = columns["genre_avg"]  # user row -> average in that genre
+        self.movies = columns["movies"]  # user row * k -> movie index, -1 if empty
+        self.scores = columns["scores"]  # user row * k -> average rating
+        self.fingerprints = fingerprints  # (catalog crc, ratings crc)
+        self._mm = mm
+        self._checked = None  # (catalog, store, store version, is_current result)
+
+    @classmethod
+    def build(cls, movies, ratings, k=3):
+        """Compute the table for every user in `ratings`."""
+        catalog = as_movie_catalog(movies)
+        store = as_ratings_store(ratings)
+        entries = cls._compute(catalog, store, store.user_ids(), k)
+        return cls._from_entries(catalog, store, entries, k)
+
+    @staticmethod
+    def _compute(catalog, store, user_ids, k):
+        movie_genres = _movie_genres(catalog, store)
+        genre_index = _genre_index(catalog, store)
+        with INSTRUMENTATION.phase("aggregate"):
+            return {
+                user_id: _user_recommendation(
+                    catalog, store, movie_genres, genre_index, user_id, k
+                )
+                for user_id in user_ids
+            }
+
+    @classmethod
+    def _from_entries(cls, catalog, store, entries, k):
+        """Pack {user_id: (genre, genre avg, [(movie, avg), ...])} into sorted columns."""
+        genres = []
+        genre_slots = {}
+        columns = {
+            "user_ids": array("q"),
+            "genre": array("i"),
+            "genre_avg": array("d"),
+            "movies": array("i"),
+            "scores": array("d"),
+        }
+        index = store.index
+        for user_id in sorted(entries):
+            genre, genre_avg, recs = entries[user_id]
+            slot = -1
+            if genre is not None:
+                slot = genre_slots.get(genre)
+                if slot is None:
+                    slot = genre_slots[genre] = len(genres)
+                    genres.append(genre)
+            columns["user_ids"].append(user_id)
+            columns["genre"].append(slot)
+            columns["genre_avg"].append(genre_avg)
+            for movie, avg in recs:
+                columns["movies"].append(index[movie])
+                columns["scores"].append(avg)
+            for _ in range(k - len(recs)):
+                columns["movies"].append(-1)
+                columns["scores"].append(0.0)
+        fingerprints = (
+            _catalog_fingerprint(catalog),
+            _ratings_fingerprint(store, store.rows()),
+        )
+        return cls(k, store.rows(), list(store.names), genres, columns, fingerprints)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __contains__(self, user_id):
+        return self._row(user_id) is not None
+
+    def _row(self, user_id):
+        row = bisect.bisect_left(self.user_ids, user_id)
+        if row < len(self.user_ids) and self.user_ids[row] == user_id:
+            return row
+        return None
+
+    def entry(self, user_id):
+        """
+        Return (preferred genre, its average, [(movie, avg), ...]) for one user,
+        or None if the user is not in the table.
+        """
+        row = self._row(user_id)
+        if row is None:
+            return None
+        slot = self.genre[row]
+        if slot < 0:
+            return None, 0.0, []
+        recs = []
+        for i in range(row * self.k, (row + 1) * self.k):
+            idx = self.movies[i]
+            if idx < 0:
+                break
+            recs.append((self.names[idx], self.scores[i]))
+        return self.genres[slot], self.genre_avg[row], recs
+
+    def lookup(self, user_id):
+        """
+        Return (preferred genre, [(movie, avg), ...]) for one user, exactly as
+        recommend_movies_batch would compute it, or None if the user is not in
+        the table.
+        """
+        entry = self.entry(user_id)
+        if entry is None:
+            return None
+        return entry[0], entry[2]
+
+    def entries(self):
+        """Return every row as {user_id: (genre, genre avg, recs)}."""
+        return {user_id: self.entry(user_id) for user_id in self.user_ids}
+
+    def is_current(self, movies, ratings):
+        """True if the table reflects exactly these movies and ratings."""
+        store = as_ratings_store(ratings)
+        return (
+            store.rows() == self.rows
+            and list(store.names) == self.names
+            and self.fingerprints
+            == (
+                _catalog_fingerprint(as_movie_catalog(movies)),
+                _ratings_fingerprint(store, self.rows),
+            )
+        )
+
+    def serves(self, catalog, store):
+        """
+        is_current() for a loaded catalog and store, remembered until the store
+        changes, so query paths can consult the table on every call.
+        """
+        checked = self._checked
+        if (
+            checked is None
+            or checked[0] is not catalog
+            or checked[1] is not store
+            or checked[2] != store.version
+        ):
+            checked = self._checked = (
+                catalog,
+                store,
+                store.version,
+                self.is_current(catalog, store),
+            )
+        return checked[3]
+
+    def update(self, movies, ratings):
+        """
+        Bring the table up to date with `ratings` and return the number of
+        users recomputed.
+
+        If the ratings only gained rows since the table was built, just the
+        users who rated something new, users whose preferred genre contains a
+        newly rated movie, and raters of a title a new case variant replaces
+        in the join are recomputed; everyone else's answer
+        cannot have changed. A different catalog or rewritten ratings
+        rebuild the whole table.
+        """
+        catalog = as_movie_catalog(movies)
+        store = as_ratings_store(ratings)
+        extends = (
+            store.rows() >= self.rows
+            and store.names[: len(self.names)] == self.names
+            and self.fingerprints
+            == (_catalog_fingerprint(catalog), _ratings_fingerprint(store, self.rows))
+        )
+        if not extends:
+            entries = self._compute(catalog, store, store.user_ids(), self.k)
+            self.__dict__.update(self._from_entries(catalog, store, entries, self.k).__dict__)
+            return len(entries)
+        if store.rows() == self.rows:
+            return 0
+
+        new_users = set(store.user_id[self.rows : store.rows()])
+        movie_genres = _movie_genres(catalog, store)
+        changed_genres = set()
+        for idx in set(store.movie_idx[self.rows : store.rows()]):
+            name = store.names[idx]
+            if name in catalog:
+                changed_genres.add(catalog.genre_id(catalog[name][0]))
+            if movie_genres[idx] is not None:
+                changed_genres.add(movie_genres[idx])
+        changed_titles = {catalog.genre_names[g].title() for g in changed_genres}
+
+        # A new name sharing its lowercase form with an older one takes over
+        # the case-insensitive join, so everyone who rated the older spelling
+        # loses those ratings from their genre averages.
+        new_keys = {name.lower() for name in store.names[len(self.names) :]}
+        if new_keys:
+            replaced = {}
+            for idx, name in enumerate(self.names):
+                key = name.lower()
+                if key in new_keys:
+                    replaced[key] = idx
+            movie_rows = store._movie_index_rows() if replaced else {}
+            for idx in replaced.values():
+                new_users.update(store.user_id[row] for row in movie_rows.get(idx, ()))
+
+        entries = self.entries()
+        stale = new_users | {
+            user_id for user_id, (genre, _, _) in entries.items() if genre in changed_titles
+        }
+        entries.update(self._compute(catalog, store, stale, self.k))
+        self.__dict__.update(self._from_entries(catalog, store, entries, self.k).__dict__)
+        return len(stale)
+
+    def save(self, path):
+        header = {
+            "k": self.k,
+            "rows": self.rows,
+            "names": self.names,
+            "genres": self.genres,
+            "fingerprints": list(self.fingerprints),
+        }
+        columns = {
+            "user_ids": self.user_ids,
+            "genre": self.genre,
+            "genre_avg": self.genre_avg,
+            "movies": self.movies,
+            "scores": self.scores,
+        }
+        _write_columns(path, _RECS_MAGIC, header, columns)
+
+    @classmethod
+    def open(cls, path, movies, ratings, k=3):
+        """
+        Load the table saved at `path` and bring it up to date with `ratings`,
+        saving it again if anything was recomputed; build and save a new one if
+        there is no usable table there.
+        """
+        try:
+            table = cls.load(path)
+        except (OSError, ValueError):
+            table = None
+        if table is None or table.k < k:
+            table = cls.build(movies, ratings, k)
+            table.save(path)
+        elif table.update(movies, ratings):
+            table.save(path)
+        return table
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a table written by save()."""
+        mapped = _map_columns(path, _RECS_MAGIC, _RECS_COLUMN_GROUPS)
+        if mapped is not None:
+            header, columns, _ = mapped
+            if len(columns["movies"]) != len(columns["user_ids"]) * header.get("k", -1):
+                mapped = None
+        if mapped is None:
+            raise ValueError(f"{path} is not a recommendation table")
+        header, columns, mm = mapped
+        return cls(
+            header["k"],
+            header["rows"],
+            header["names"],
+            header["genres"],
+            columns,
+            tuple(header["fingerprints"]),
+            mm,
+        )
+
+
+class QueryEngine:
+    """
+    Answers query dicts against one loaded dataset.
+
+    Derived data (the movie -> genre join, full movie and genre rankings and
+    per-genre candidate lists) is built on first use and reused by every later
+    query, so the cost of loading and indexing is paid once per engine. A
+    RecommendationTable, if given, answers genre recommendations while it
+    is up to date with the movies and ratings.
+
+    Supported queries, e.g. {"query": "movie_popularity", "n": 5}:
+        movie_popularity          n, offset
+        movie_popularity_in_genre genre, n, offset
+        genre_popularity          n, offset
+        user_preference           user_id
+        recommend_movies          user_id, k (default 3), engine ("genre" or "item")
+    """
+
+    def __init__(self, movies, ratings, table=None):
+        self.movies = as_movie_catalog(movies)
+        self.store = as_ratings_store(ratings)
+        self.table = table  # optional RecommendationTable for genre recommendations
+        self._movie_genres = None
+        self._ranked_movies = None
+        self._ranked_genres = None
+        self._version = self.store.version
+
+    def _refresh(self):
+        """Drop cached rankings if ratings were ingested since they were built."""
+        if self._version != self.store.version:
+            self._movie_genres = None
+            self._ranked_movies = None
+            self._ranked_genres = None
+            self._version = self.store.version
+
+    def warm(self):
+        """Build every shared index up front instead of on the first query."""
+        self.store.user_ids()
+        self.movie_genres()
+        _genre_index(self.movies, self.store)
+        self.movie_popularity(0)
+        self.genre_popularity(0)
+        return self
+
+    def movie_genres(self):
+        if self._movie_genres is None:
+            self._movie_genres = _movie_genres(self.movies, self.store)
+        return self._movie_genres
+
+    def movie_popularity(self, n, offset=0):
+        self._refresh()
+        if self._ranked_movies is None:
+            self._ranked_movies = top_movies(self.store, len(self.store))
+        return _page(self._ranked_movies, n, offset)
+
+    def movie_popularity_in_genre(self, genre, n, offset=0):
+        return top_movies_in_genre(self.movies, self.store, genre, n, offset)
+
+    def genre_popularity(self, n, offset=0):
+        self._refresh()
+        if self._ranked_genres is None:
+            self._ranked_genres = top_genres(self.movies, self.store, len(self.movies))
+        return _page(self._ranked_genres, n, offset)
+
+    def user_preference(self, user_id):
+        self._refresh()
+        genre_avg = _user_genre_averages(
+            self.movies, self.store, self.movie_genres(), user_id
+        )
+        if not genre_avg:
+            return None
+        genre, avg = max(genre_avg.items(), key=itemgetter(1))
+        return genre.title(), avg
+
+    def recommend_movies(self, user_id, k=3, engine="genre"):
+        self._refresh()
+        k = max(k, 0)
+        if engine == "item":
+            return None, self.store.item_similarity().recommend(self.store, user_id, k)
+        if engine != "genre":
+            raise ValueError(f"unknown recommendation engine: {engine!r}")
+        table = self.table
+        if table is not None and k <= table.k and table.serves(self.movies, self.store):
+            answer = table.lookup(user_id)
+            if answer is not None:
+                return answer[0], answer[1][:k]
+        return _recommend_for_user(
+            self.movies,
+            self.store,
+            self.movie_genres(),
+            _genre_index(self.movies, self.store),
+            user_id,
+            k,
+        )
+
+    def run(self, query):
+        """
+        Answer one query dict and return a JSON-serialisable result dict.
+
+        Bad queries produce {"error": ...} instead of raising, so a stream of
+        queries keeps going past a single malformed entry.
+
+        Adding "profile": "cprofile" or "profile": "tracemalloc" to a query
+        attaches cProfile stats or peak-memory figures for that query alone.
+        """
+        name = query.get("query")
+        response = {"query": name}
+        if "id" in query:
+            response["id"] = query["id"]
+        profile = query.get("profile")
+        try:
+            with INSTRUMENTATION.call(f"query:{name}"):
+                if profile == "cprofile":
+                    result, response["profile"] = profile_call(self._answer, name, query)
+                elif profile == "tracemalloc":
+                    result, peak, top = trace_memory_call(self._answer, name, query)
+                    response["memory"] = {"peak_bytes": peak, "top": top}
+                elif profile:
+                    raise ValueError(f"unknown profiler: {profile!r}")
+                else:
+                    result = self._answer(name, query)
+        except KeyError as e:
+            response["error"] = f"missing field: {e.args[0]}"
+        except (TypeError, ValueError, OverflowError) as e:
+            response["error"] = str(e)
+        else:
+            response["result"] = result
+        return response
+
+
+    def _answer(self, name, query):
+        if name == "movie_popularity":
+            return self.movie_popularity(int(query["n"]), int(query.get("offset", 0)))
+        if name == "movie_popularity_in_genre":
+            return self.movie_popularity_in_genre(
+                str(query["genre"]), int(query["n"]), int(query.get("offset", 0))
+            )
+        if name == "genre_popularity":
+            return self.genre_popularity(int(query["n"]), int(query.get("offset", 0)))
+        if name == "user_preference":
+            return self.user_preference(int(query["user_id"]))
+        if name == "recommend_movies":
+            genre, recs = self.recommend_movies(
+                int(query["user_id"]), int(query.get("k", 3)), query.get("engine", "genre")
+            )
+            return {"genre": genre, "movies": recs}
+        raise ValueError(f"unknown query: {name!r}")
+
+
+def _page(ranked, n, offset=0):
+    """Slice a pre-ranked list the same way rank_items() pages results."""
+    offset = max(offset, 0)
+    return ranked[offset : offset + max(n, 0)]
+
+
+def parse_query_line(line):
+    """Return (query dict, None) for a JSONL query line, or (None, error response)."""
+    try:
+        query = json.loads(line)
+        if not isinstance(query, dict):
+            raise ValueError("query must be a JSON object")
+    except ValueError as e:
+        return None, {"error": f"invalid query line: {e}"}
+    return query, None
+
+
+def run_batch_queries(engine, lines, out=sys.stdout):
+    """
+    Stream JSONL queries from `lines` through `engine`, writing one JSONL
+    result per non-blank line to `out`. Returns (queries answered, seconds).
+    """
+    count = 0
+    start = time.perf_counter()
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        query, response = parse_query_line(line)
+        if query is not None:
+            response = engine.run(query)
+        out.write(json.dumps(response) + "\n")
+        count += 1
+    return count, time.perf_counter() - start
+
+
+class DatasetSnapshot:
+    """
+    An immutable, fully indexed dataset: the movies, the ratings and every
+    derived index (genre join, per-user index, genre and movie rankings),
+    all built before the snapshot is handed out.
+
+    Nothing changes a snapshot once it exists, so any number of threads can
+    query it without locks. Changes produce a new snapshot instead; see
+    LiveDataset. A RatingsStore is held through a RatingsView, so later
+    snapshots can append to the store and share its rows.
+    """
+
+    __slots__ = ("movies", "ratings", "generation", "engine")
+
+    def __init__(self, movies, ratings, generation=0, table=None):
+        ratings = as_ratings_store(ratings)
+        if type(ratings) is RatingsStore:
+            ratings = ratings.view()
+        engine = QueryEngine(movies, ratings, table).warm()
+        object.__setattr__(self, "movies", engine.movies)
+        object.__setattr__(self, "ratings", engine.store)
+        object.__setattr__(self, "generation", generation)
+        object.__setattr__(self, "engine", engine)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DatasetSnapshot is immutable; build a new one instead")
+
+    @classmethod
+    def load(cls, movies_file, ratings_file, workers=1, generation=0):
+        """
+        Load the movies and ratings (each a file, or catalogues or shards as
+        on the command line) and index them into a new snapshot.
+        """
+        movies = load_movies_source(movies_file)
+        ratings = load_ratings_source(ratings_file, workers)
+        return cls(movies, ratings, generation)
+
+    def run(self, query):
+        """Answer one query dict (see QueryEngine) against this snapshot."""
+        return self.engine.run(query)
+
+    def with_rows(self, rows, source="<ingest>"):
+        """
+        Return (new snapshot with `rows` ingested, rows applied).
+
+        If this is the newest snapshot of its store, the rows are appended to
+        the store and the new snapshot is another view of it, so this costs
+        O(new rows + movies); this snapshot's view does not see them. An older
+        snapshot is copied first (O(ratings)) so the branches stay apart.
+        Writers must be serialised, as LiveDataset does.
+        """
+        ratings = self.ratings
+        if isinstance(ratings, RatingsView) and ratings.rows() == ratings.store.rows():
+            store = ratings.store
+        else:
+            store = ratings.copy()
+        applied = ingest_ratings_rows(store, rows, source)
+        return DatasetSnapshot(self.movies, store, self.generation + 1), applied
+
+
+class LiveDataset:
+    """
+    The current DatasetSnapshot of a running service, replaced on every change.
+
+    Readers call current() and may keep using the snapshot they got for as
+    long as they like. reload() and ingest() build a complete new snapshot
+    first and then publish it with one reference assignment, so a reader sees
+    either the old or the new data and never a half-loaded mix. Writers are
+    serialised by a lock; readers never take it.
+    """
+
+    def __init__(self, snapshot=None):
+        self._snapshot = snapshot
+        self._write_lock = threading.Lock()
+
+    def current(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise RuntimeError("no dataset loaded yet")
+        return snapshot
+
+    def publish(self, snapshot):
+        """Make `snapshot` the current one."""
+        with self._write_lock:
+            self._snapshot = snapshot
+
+    def reload(self, movies_file, ratings_file, workers=1):
+        """Load the files into a new snapshot and swap it in; returns the snapshot."""
+        with self._write_lock:
+            generation = self._snapshot.generation + 1 if self._snapshot else 0
+            snapshot = DatasetSnapshot.load(movies_file, ratings_file, workers, generation)
+            self._snapshot = snapshot
+        return snapshot
+
+    def ingest(self, rows, source="<ingest>"):
+        """Publish a copy of the current snapshot with `rows` appended; returns rows applied."""
+        with self._write_lock:
+            snapshot, applied = self.current().with_rows(rows, source)
+            self._snapshot = snapshot
+        return applied
+
+
+class SnapshotQueryExecutor:
+    """
+    Runs query dicts on a thread pool against a LiveDataset.
+
+    submit() pins each query to the snapshot current when it is submitted;
+    map() pins one snapshot for a whole batch, so every answer in the batch
+    comes from the same data even if a reload is published halfway through.
+    Queries are pure Python, so under the GIL threads mainly overlap I/O and
+    waiting; CPU-bound speed-ups need a free-threaded interpreter.
+    """
+
+    def __init__(self, dataset, max_workers=None):
+        self.dataset = dataset
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, query):
+        """Schedule one query; returns a concurrent.futures.Future of its response."""
+        return self._pool.submit(self.dataset.current().run, query)
+
+    def map(self, queries):
+        """Answer `queries` in parallel against one snapshot; responses keep input order."""
+        snapshot = self.dataset.current()
+        return list(self._pool.map(snapshot.run, queries))
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        return False
+
+
+_LINE_TOO_LONG = object()  # QueryServer._read_line() result for an over-long line
+
+
+class QueryServer:
+    """
+    Long-running asyncio query server over a line-delimited JSON protocol.
+
+    Clients connect over TCP and send one query per line in the same format as
+    the batch mode (see QueryEngine); each line gets one JSON response line.
+    The special query {"query": "reload"} re-reads the data files,
+    {"query": "ingest", "rows": ["name|rating|user_id", ...]} appends new
+    ratings to the live dataset and {"query": "stats"} returns the
+    instrumentation counters.
+
+    The data lives in a LiveDataset and queries run on a thread pool
+    (SnapshotQueryExecutor), each against the snapshot current when it
+    arrived. Reloads and ingests build a new snapshot in a worker thread while
+    queries keep being answered from the old one, then swap it in: each query
+    sees either the old or the new dataset, never a mix.
+
+    Query lines may be up to `max_line` bytes long (large enough for ingests
+    of many thousands of rows); a longer line is skipped and answered with an
+    error.
+    """
+
+    def __init__(self, movies_file, ratings_file, workers=1, threads=None, max_line=1 << 24):
+        self.movies_file = movies_file
+        self.ratings_file = ratings_file
+        self.workers = workers
+        self.max_line = max_line
+        self.dataset = LiveDataset()
+        self.executor = SnapshotQueryExecutor(self.dataset, threads)
+        self._reload_lock = asyncio.Lock()
+
+    @property
+    def engine(self):
+        """QueryEngine of the current snapshot."""
+        return self.dataset.current().engine
+
+    def _reload(self):
+        with redirect_stdout(sys.stderr):
+            self.dataset.reload(self.movies_file, self.ratings_file, self.workers)
+
+    async def reload(self):
+        """Load fresh data off the event loop and atomically swap it in."""
+        async with self._reload_lock:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._reload)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await self._read_line(reader)
+                if not line:
+                    break
+                try:
+                    if line is _LINE_TOO_LONG:
+                        raise ValueError(f"query line longer than {self.max_line} bytes")
+                    line = line.decode("utf-8").strip()
+                except ValueError as e:
+                    query, response = None, {"error": f"invalid query line: {e}"}
+                else:
+                    if not line:
+                        continue
+                    query, response = parse_query_line(line)
+                if query is not None and query.get("query") == "reload":
+                    try:
+                        await self.reload()
+                    except Exception as e:
+                        # Keep serving the old snapshot; the client learns why
+                        response = {"query": "reload", "error": f"reload failed: {e}"}
+                    else:
+                        response = {"query": "reload", "result": "ok"}
+                elif query is not None and query.get("query") == "ingest":
+                    response = await asyncio.get_running_loop().run_in_executor(
+                        None, self._ingest, query
+                    )
+                elif query is not None and query.get("query") == "stats":
+                    response = {"query": "stats", "result": INSTRUMENTATION.as_dict()}
+                elif query is not None:
+                    response = await asyncio.wrap_future(self.executor.submit(query))
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_line(reader):
+        """
+        Return the next line from `reader`, b"" at end of stream, or
+        _LINE_TOO_LONG after discarding a line over the reader's limit.
+        """
+        try:
+            return await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+        while True:
+            try:
+                await reader.readexactly(consumed)
+                await reader.readuntil(b"\n")
+                return _LINE_TOO_LONG
+            except asyncio.IncompleteReadError:
+                return _LINE_TOO_LONG
+            except asyncio.LimitOverrunError as e:
+                consumed = e.consumed
+
+    def _ingest(self, query):
+        rows = query.get("rows")
+        if not isinstance(rows, list):
+            return {"query": "ingest", "error": "rows must be a list of name|rating|user_id strings"}
+        with redirect_stdout(sys.stderr):
+            applied = self.dataset.ingest([str(row) for row in rows])
+        return {"query": "ingest", "result": applied}
+
+    async def start(self, host="127.0.0.1", port=8765):
+        """Load the data, then start listening. Returns the asyncio server."""
+        await self.reload()
+        return await asyncio.start_server(self.handle_client, host, port, limit=self.max_line)
+
+
+async def _serve_forever(server, host, port):
+    listener = await server.start(host, port)
+    address = listener.sockets[0].getsockname()
+    print(f"Serving queries on {address[0]}:{address[1]}", file=sys.stderr)
+    async with listener:
+        await listener.serve_forever()
 
 
 def print_menu():
@@ -256,13 +2798,120 @@ def print_menu():
     print("6. Show user's top genre")
     print("7. Recommend movies for a user")
     print("8. Exit")
+    print("9. Show performance report")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Movie recommender system.")
+    parser.add_argument(
+        "--movies", help="movie data file to load (comma-separated for several catalogues)"
+    )
+    parser.add_argument(
+        "--ratings", help="ratings data file, or a directory or glob of ratings shards"
+    )
+    parser.add_argument(
+        "--queries",
+        help="run non-interactively: answer JSONL queries from this file ('-' for stdin)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="processes used to parse the ratings file"
+    )
+    parser.add_argument(
+        "--error-examples",
+        type=int,
+        help="with --queries: summarise skipped rows, keeping this many examples per category",
+    )
+    parser.add_argument(
+        "--quarantine", help="with --queries: write every skipped row to this file"
+    )
+    parser.add_argument(
+        "--recs-table",
+        help="with --queries: answer recommendations from this precomputed table "
+        "(built or updated as needed)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="with --queries: keep only per-movie aggregates (movie and genre rankings only)",
+    )
+    parser.add_argument(
+        "--serve", action="store_true", help="run a JSON query server instead of the menu"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="collect call counts and timings (menu option 9, or printed at the end of --queries)",
+    )
+    parser.add_argument(
+        "--threads", type=int, help="query threads per server (--serve; default: Python's choice)"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="server address (--serve)")
+    parser.add_argument("--port", type=int, default=8765, help="server port (--serve)")
+    return parser.parse_args(argv)
+
+
+def batch_main(args):
+    """Load the data once, answer every query in args.queries, report throughput."""
+    if not args.movies or not args.ratings:
+        sys.exit("--queries requires --movies and --ratings")
 
+    report = None
+    if args.error_examples is not None or args.quarantine:
+        examples = 5 if args.error_examples is None else args.error_examples
+        report = LoadReport(examples, args.quarantine)
 
-def main():
+    # Loader messages go to stderr so stdout stays pure JSONL
+    with redirect_stdout(sys.stderr):
+        movies = load_movies_source(args.movies, errors=report)
+        ratings = load_ratings_source(
+            args.ratings, args.workers, stream=args.stream, errors=report
+        )
+    if report is not None:
+        report.close()
+        print(json.dumps({"load_report": report.as_dict()}), file=sys.stderr)
+    table = None
+    if args.recs_table:
+        if isinstance(ratings, RatingsAggregates):
+            sys.exit("--recs-table needs per-user ratings; drop --stream")
+        table = RecommendationTable.open(args.recs_table, movies, ratings)
+    engine = QueryEngine(movies, ratings, table)
+
+    if args.queries == "-":
+        count, elapsed = run_batch_queries(engine, sys.stdin)
+    else:
+        with open(args.queries, "r") as f:
+            count, elapsed = run_batch_queries(engine, f)
+    qps = count / elapsed if elapsed > 0 else float("inf")
+    print(f"Answered {count} queries in {elapsed:.3f}s ({qps:.1f} queries/sec)", file=sys.stderr)
+    if args.profile:
+        print(INSTRUMENTATION.report(), file=sys.stderr)
+
+
+def main(argv=None):
     """
     Main interactive menu loop for the movie recommender system.
     Allows the user to load data files and test various functions interactively.
+
+    With --queries the menu is skipped and JSONL queries are answered in batch;
+    with --serve the data is kept loaded behind a QueryServer.
     """
+    args = parse_args(argv)
+    INSTRUMENTATION.enabled = args.profile
+    if args.serve:
+        if not args.movies or not args.ratings:
+            sys.exit("--serve requires --movies and --ratings")
+        server = QueryServer(
+            args.movies, args.ratings, workers=args.workers, threads=args.threads
+        )
+        try:
+            asyncio.run(_serve_forever(server, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.queries:
+        batch_main(args)
+        return
+
     movies = []
     ratings = []
 
@@ -273,7 +2922,8 @@ def main():
         if choice == "1":
             try:
                 filename = input("Enter movie data filename: ").strip()
-                movies = load_movies_file(filename)
+                movies = load_movies_source(filename)
+                QUERY_CACHE.invalidate()
             except FileNotFoundError:
                 print("Error: File not found.")
             except Exception as e:
@@ -282,7 +2932,11 @@ def main():
         elif choice == "2":
             try:
                 filename = input("Enter ratings data filename: ").strip()
-                ratings = load_ratings_file(filename)
+                if _is_sharded(filename):
+                    ratings = load_ratings_shards(filename)
+                else:
+                    ratings = load_ratings_file(filename, snapshot=True)
+                QUERY_CACHE.invalidate()
             except FileNotFoundError:
                 print("Error: File not found.")
             except Exception as e:
@@ -338,6 +2992,10 @@ def main():
             print("Exiting program.")
             sys.exit(0)
 
+        elif choice == "9":
+            print(INSTRUMENTATION.report())
+            print(QUERY_CACHE.report())
+
         else:
             print("Invalid choice. Please try again.")
 
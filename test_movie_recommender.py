@@ -1,4 +1,6 @@
+import asyncio
 import io
+import json
 import os
 import tempfile
 from contextlib import redirect_stdout
@@ -222,6 +224,1036 @@ Lethal Weapon|5.0|1"""
     )
 
 
+# ---------------- Ratings Store Tests ---------------- #
+
+
+def test_ratings_store():
+    print("\n=== Ratings Store Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    store = mr.load_ratings_file("ratings1.txt")
+    plain = store.as_dict()
+
+    # 1. Dict-compatible view matches a plain dict copy
+    mark(
+        isinstance(store, mr.RatingsStore) and dict(store.items()) == plain,
+        "RatingsStore dict view",
+    )
+
+    # 2. Query functions accept plain dicts and stores alike
+    out_store = capture_output(mr.recommend_movies, 6, movies, store)
+    out_plain = capture_output(mr.recommend_movies, 6, movies, plain)
+    mark(out_store == out_plain, "recommend_movies() dict/store parity", out_plain, out_store)
+
+    # 3. Per-user index returns exactly the user's rows
+    user = 6
+    expected = sorted(m for m, lst in plain.items() for _, uid in lst if uid == user)
+    actual = sorted(store.names[store.movie_idx[row]] for row in store.user_rows(user))
+    mark(actual == expected, f"user_rows({user})", expected, actual)
+
+    # 4. Appending a rating updates the running movie aggregates
+    name = store.names[0]
+    store.append(name, 1.0, 999)
+    vals = [r for r, _ in store[name]]
+    expected = sum(vals) / len(vals)
+    actual = store.movie_average(store.index[name])
+    mark(actual == expected, "append() updates movie aggregates", expected, actual)
+
+    # 5. The dict view's per-movie row index follows later appends
+    store.append(name, 2.0, 1000)
+    store.append("Brand New Movie", 3.0, 1000)
+    mark(
+        store[name][-2:] == [(1.0, 999), (2.0, 1000)] and store["Brand New Movie"] == [(3.0, 1000)],
+        "Dict view stays current after append()",
+    )
+
+
+# ---------------- Ranking API Tests ---------------- #
+
+
+def test_ranking_api():
+    print("\n=== Ranking API Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+
+    # 1. top_movies() returns (movie, avg) pairs in reference order
+    ret = [m for m, _ in mr.top_movies(ratings, 3)]
+    expected = expected_movie_popularity(ratings, 3)
+    mark(ret == expected, "top_movies() top 3", expected, ret)
+
+    # 2. N larger than the catalog is clamped instead of raising
+    ret = mr.top_movies(ratings, len(ratings) + 10)
+    mark(len(ret) == len(ratings), "top_movies() clamps N", len(ratings), len(ret))
+    out = capture_output(mr.movie_popularity, ratings, len(ratings) + 10)
+    mark("Here are the top" in out, "movie_popularity() with N > movies")
+
+    # 3. Offset/limit paging matches the full ranking
+    full = mr.top_movies(ratings, len(ratings))
+    page = mr.top_movies(ratings, 2, offset=3)
+    mark(page == full[3:5], "top_movies() paging", full[3:5], page)
+
+    # 4. Genre ranking API mirrors the print wrapper
+    ret = [m for m, _ in mr.top_movies_in_genre(movies, ratings, "adventure", 2)]
+    expected = expected_movie_popularity_in_genre(movies, ratings, "Adventure", 2)
+    mark(ret == expected, "top_movies_in_genre()", expected, ret)
+
+
+# ---------------- Parallel Loader Tests ---------------- #
+
+
+def test_parallel_loader():
+    print("\n=== Parallel Loader Tests ===")
+    with open("ratings1.txt") as f:
+        content = f.read()
+    rf = make_temp_file("BadLine\n" + content + "Heat (1995)|great|4\n")
+
+    serial_out = capture_output(mr.load_ratings_file, rf)
+    serial = mr.load_ratings_file(rf).as_dict()
+    parallel_out = capture_output(mr.load_ratings_file, rf, workers=3)
+    parallel = mr.load_ratings_file(rf, workers=3).as_dict()
+
+    mark(parallel == serial, "Parallel load matches serial load")
+    mark(
+        parallel_out == serial_out,
+        "Parallel load warnings and line numbers",
+        serial_out,
+        parallel_out,
+    )
+
+
+# ---------------- Snapshot Cache Tests ---------------- #
+
+
+def test_snapshot_cache():
+    print("\n=== Snapshot Cache Tests ===")
+    with open("ratings1.txt") as f:
+        rf = make_temp_file(f.read())
+
+    parsed = mr.load_ratings_file(rf, snapshot=True)
+    cached = mr.load_ratings_file(rf, snapshot=True)
+    mark(
+        cached._snapshot is not None and cached.as_dict() == parsed.as_dict(),
+        "Ratings snapshot reloads identical data",
+    )
+
+    # Changing the source invalidates the snapshot
+    with open(rf, "a") as f:
+        f.write("Heat (1995)|1.0|99\n")
+    fresh = mr.load_ratings_file(rf, snapshot=True)
+    mark(
+        fresh._snapshot is None and (1.0, 99) in fresh["Heat (1995)"],
+        "Stale snapshot is rebuilt",
+    )
+
+    # A truncated snapshot is re-parsed instead of mapped short or crashing
+    snap = rf + mr.SNAPSHOT_SUFFIX
+    with open(snap, "rb") as f:
+        data = f.read()
+    stat = os.stat(rf)
+    ok = True
+    for cut in (8, 13, 200):
+        with open(snap, "wb") as f:
+            f.write(data[:-cut])
+        os.utime(rf, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        reloaded = mr.load_ratings_file(rf, snapshot=True)
+        ok = ok and reloaded.as_dict() == fresh.as_dict()
+    mark(ok, "Truncated snapshot falls back to parsing")
+    os.remove(snap)
+
+
+# ---------------- Batch Recommendation Tests ---------------- #
+
+
+def test_batch_recommendations():
+    print("\n=== Batch Recommendation Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    users = sorted({uid for lst in ratings.values() for _, uid in lst})
+
+    batch = mr.recommend_movies_batch(movies, ratings)
+    ok = sorted(batch) == users
+    for user in users:
+        recs, _ = expected_recommendations(user, movies, ratings, 3)
+        ok = ok and [m for m, _ in batch[user]] == recs
+    mark(ok, "recommend_movies_batch() matches per-user reference")
+
+    sharded = mr.recommend_movies_batch(movies, ratings, users[:5], workers=2)
+    mark(
+        sharded == {u: batch[u] for u in users[:5]},
+        "recommend_movies_batch() sharded across processes",
+    )
+
+
+# ---------------- Batch Query Mode Tests ---------------- #
+
+
+def test_batch_queries():
+    print("\n=== Batch Query Mode Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    engine = mr.QueryEngine(movies, ratings)
+    lines = [
+        '{"id": 1, "query": "movie_popularity", "n": 3}',
+        '{"id": 2, "query": "genre_popularity", "n": 3}',
+        '{"id": 3, "query": "recommend_movies", "user_id": 6}',
+        "not json",
+    ]
+    buf = io.StringIO()
+    count, _ = mr.run_batch_queries(engine, lines, buf)
+    results = [json.loads(l) for l in buf.getvalue().splitlines()]
+
+    mark(count == 4 and len(results) == 4, "One JSONL result per query", 4, count)
+    ret = [m for m, _ in results[0]["result"]]
+    expected = expected_movie_popularity(ratings, 3)
+    mark(ret == expected, "Batch movie_popularity", expected, ret)
+    ret = [tuple(g) for g in results[1]["result"]]
+    expected = expected_genre_popularity(movies, ratings, 3)
+    mark(ret == expected, "Batch genre_popularity", expected, ret)
+    recs, pref = expected_recommendations(6, movies, ratings, 3)
+    ret = results[2]["result"]
+    mark(
+        ret["genre"] == pref and [m for m, _ in ret["movies"]] == recs,
+        "Batch recommend_movies",
+        (pref, recs),
+        ret,
+    )
+    mark("error" in results[3], "Invalid query line reported", "error", results[3])
+
+    # Out-of-range numbers are errors or clamped, never an aborted run
+    lines = [
+        '{"query": "movie_popularity", "n": 1e999}',
+        '{"query": "recommend_movies", "user_id": 6, "k": -1}',
+    ]
+    buf = io.StringIO()
+    count, _ = mr.run_batch_queries(engine, lines, buf)
+    results = [json.loads(l) for l in buf.getvalue().splitlines()]
+    mark(
+        count == 2 and "error" in results[0] and results[1]["result"]["movies"] == [],
+        "Overflowing n is an error and negative k is clamped",
+        None,
+        results,
+    )
+
+
+# ---------------- Query Server Tests ---------------- #
+
+
+async def _query_server(server, lines, ratings_file=None):
+    listener = await server.start("127.0.0.1", 0)
+    if ratings_file is not None:
+        server.ratings_file = ratings_file  # later reloads read this file
+    port = listener.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    responses = []
+    for line in lines:
+        writer.write((line if isinstance(line, bytes) else line.encode()) + b"\n")
+        await writer.drain()
+        responses.append(json.loads(await reader.readline()))
+    writer.close()
+    await writer.wait_closed()
+    listener.close()
+    await listener.wait_closed()
+    return responses
+
+
+def test_query_server():
+    print("\n=== Query Server Tests ===")
+    with open("ratings1.txt") as f:
+        rf = make_temp_file(f.read())
+    with open("movies1.txt") as f:
+        mf = make_temp_file(f.read())
+    movies = mr.load_movies_file(mf)
+    ratings = mr.load_ratings_file(rf)
+    server = mr.QueryServer(mf, rf)
+
+    lines = ['{"query": "user_preference", "user_id": 6}']
+    ret = asyncio.run(_query_server(server, lines))[0]["result"]
+    expected = expected_user_preference(movies, ratings, 6)
+    mark(ret and ret[0] == expected, "Server user_preference", expected, ret)
+
+    # Reload picks up new data for queries after the swap
+    with open(rf, "a") as f:
+        f.write("Sudden Death (1995)|5.0|6\nHeat (1995)|5.0|6\n")
+    lines = ['{"query": "reload"}', '{"query": "recommend_movies", "user_id": 6}']
+    responses = asyncio.run(_query_server(server, lines))
+    ratings = mr.load_ratings_file(rf)
+    recs, pref = expected_recommendations(6, movies, ratings, 3)
+    ret = responses[1]["result"]
+    mark(
+        responses[0].get("result") == "ok"
+        and ret["genre"] == pref
+        and [m for m, _ in ret["movies"]] == recs,
+        "Server reload swaps dataset",
+        (pref, recs),
+        ret,
+    )
+
+    # A failed reload or an undecodable line gets an error reply, not a dropped connection
+    lines = [
+        b"\xff\xfe not utf-8",
+        '{"query": "reload"}',
+        '{"query": "user_preference", "user_id": 6}',
+    ]
+    responses = asyncio.run(_query_server(server, lines, ratings_file=rf + ".missing"))
+    mark(
+        "invalid query line" in responses[0].get("error", "")
+        and "reload failed" in responses[1].get("error", "")
+        and responses[2].get("result", [None])[0] == expected_user_preference(movies, ratings, 6),
+        "Server reports reload and decode errors and keeps serving",
+        None,
+        responses,
+    )
+
+    # Ingests of thousands of rows fit on one line; longer lines get an error
+    server.ratings_file = rf
+    rows = [f"Heat (1995)|4.0|{user_id}" for user_id in range(10000, 15000)]
+    lines = [json.dumps({"query": "ingest", "rows": rows})]
+    responses = asyncio.run(_query_server(server, lines))
+    mark(responses[0].get("result") == 5000, "Server accepts a 5,000-row ingest", 5000, responses)
+    small = mr.QueryServer(mf, rf, max_line=1024)
+    lines = ["x" * 5000, '{"query": "user_preference", "user_id": 6}']
+    responses = asyncio.run(_query_server(small, lines))
+    mark(
+        "longer than 1024 bytes" in responses[0].get("error", "")
+        and responses[1].get("result", [None])[0] == expected_user_preference(movies, ratings, 6),
+        "Server answers an over-long line with an error and keeps serving",
+        None,
+        responses,
+    )
+    os.remove(mf + mr.SNAPSHOT_SUFFIX)
+    os.remove(rf + mr.SNAPSHOT_SUFFIX)
+
+
+# ---------------- Benchmark Suite Tests ---------------- #
+
+
+def test_benchmark_suite():
+    print("\n=== Benchmark Suite Tests ===")
+    import benchmark_movie_recommender as bench
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mf, rf = bench.generate_dataset(tmp, 2000, seed=1)
+        os.makedirs(os.path.join(tmp, "again"))
+        _, rf_again = bench.generate_dataset(os.path.join(tmp, "again"), 2000, seed=1)
+        with open(rf) as f, open(rf_again) as g:
+            lines, lines_again = f.read().splitlines(), g.read().splitlines()
+        mark(len(lines) == 2000, "Generator writes requested rating count", 2000, len(lines))
+        mark(lines == lines_again, "Generator is deterministic for a seed")
+
+        hits = mr.QUERY_CACHE.hits
+        results = bench.benchmark_dataset(mf, rf, n=5, queries=3)
+        names = [r["function"] for r in results]
+        mark(
+            mr.QUERY_CACHE.hits == hits and mr.QUERY_CACHE.maxsize > 0,
+            "Benchmark measures queries with the cache disabled",
+        )
+        mark(
+            len(names) == 7 and all(r["peak_bytes"] > 0 for r in results),
+            "Benchmark covers every function",
+            7,
+            names,
+        )
+
+
+# ---------------- Instrumentation Tests ---------------- #
+
+
+def test_instrumentation():
+    print("\n=== Instrumentation Tests ===")
+    inst = mr.INSTRUMENTATION
+    inst.reset()
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    mark(not inst.calls, "Disabled instrumentation records nothing", {}, inst.calls)
+
+    inst.enabled = True
+    try:
+        movies = mr.load_movies_file("movies1.txt")
+        ratings = mr.load_ratings_file("ratings1.txt")
+        capture_output(mr.recommend_movies, 6, movies, ratings)
+    finally:
+        inst.enabled = False
+    stats = inst.as_dict()
+    funcs = stats["functions"]
+    mark(
+        funcs.get("load_ratings_file", {}).get("rows") == 54
+        and funcs.get("load_movies_file", {}).get("calls") == 1
+        and "_compressed_opener" not in funcs
+        and funcs.get("recommend_movies", {}).get("calls") == 1
+        and funcs.get("user_preference", {}).get("calls") == 1,
+        "Calls and rows recorded per function",
+        "load_ratings_file rows=54, load_movies_file/recommend/user_preference calls=1",
+        funcs,
+    )
+    mark(
+        {"parse", "normalise", "rank", "render"} <= set(stats["phases"]),
+        "Internal phases timed",
+        "parse/normalise/rank/render",
+        sorted(stats["phases"]),
+    )
+    mark("Performance Report" in inst.report(), "Report renders")
+
+    result, text = mr.profile_call(mr.top_movies, ratings, 2)
+    mark(len(result) == 2 and "function calls" in text, "cProfile hook")
+
+    # Worker threads record while another thread takes snapshots
+    from concurrent.futures import ThreadPoolExecutor
+
+    inst.reset()
+
+    def record(worker):
+        for i in range(2000):
+            inst.record_call("query:shared", 0.0)
+            inst.record_phase(f"query:{worker}:{i % 50}", 0.0)
+        return worker
+
+    def snapshot():
+        for _ in range(200):
+            inst.as_dict()
+        return True
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        futures = [pool.submit(record, worker) for worker in range(4)]
+        futures.append(pool.submit(snapshot))
+        errors = [f.exception() for f in futures if f.exception() is not None]
+    calls = inst.as_dict()["functions"]["query:shared"]["calls"]
+    mark(
+        not errors and calls == 8000,
+        "Counts survive concurrent recording and snapshots",
+        8000,
+        (calls, errors),
+    )
+    inst.reset()
+
+
+# ---------------- Item-Item Engine Tests ---------------- #
+
+
+def expected_item_similarity(ratings, a, b):
+    def user_means(movie):
+        per_user = {}
+        for r, uid in ratings[movie]:
+            per_user.setdefault(uid, []).append(r)
+        return {uid: sum(v) / len(v) for uid, v in per_user.items()}
+
+    ra, rb = user_means(a), user_means(b)
+    dot = sum(ra[u] * rb[u] for u in ra if u in rb)
+    norm_a = sum(v * v for v in ra.values()) ** 0.5
+    norm_b = sum(v * v for v in rb.values()) ** 0.5
+    return dot / (norm_a * norm_b)
+
+
+def test_item_engine():
+    print("\n=== Item-Item Engine Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    index = ratings.item_similarity(k=3)
+    mark(ratings.item_similarity(k=3) is index, "Item index cached between calls")
+
+    # 1. Neighbour lists are capped at K and match brute-force cosine
+    ok = all(len(n) <= 3 for n in index.neighbours)
+    for i, neighbours in enumerate(index.neighbours):
+        for j, sim in neighbours:
+            expected = expected_item_similarity(ratings, ratings.names[i], ratings.names[j])
+            ok = ok and abs(sim - expected) < 1e-9
+    mark(ok, "Item similarity top-K cosine")
+
+    # 2. Recommendations skip rated movies and the engine is selectable
+    user = 1
+    rated = {m for m, lst in ratings.items() if any(uid == user for _, uid in lst)}
+    recs = index.recommend(ratings, user, 3)
+    mark(
+        recs and not rated & {m for m, _ in recs},
+        "Item engine recommends unrated movies",
+        "unrated movies",
+        recs,
+    )
+    out = capture_output(mr.recommend_movies, user, movies, ratings, engine="item")
+    mark("item-item similarity" in out, "recommend_movies(engine='item')", "item header", out)
+
+
+# ---------------- Incremental Ingestion Tests ---------------- #
+
+
+def test_incremental_ingestion():
+    print("\n=== Incremental Ingestion Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    with open("ratings1.txt") as f:
+        rf = make_temp_file(f.read())
+    store = mr.load_ratings_file(rf)
+    tail = mr.RatingsTail(rf)
+    engine = mr.QueryEngine(movies, store)
+    engine.movie_popularity(3)
+
+    # 1. Tail applies only complete new lines and reports global line numbers
+    with open(rf, "a") as f:
+        f.write("Heat (1995)|0.5|6\nBad|row\nSudden Death (1995)|5.0|")
+    out = capture_output(tail.poll, store)
+    mark("line 56" in out, "Tail warning uses file line number", "line 56", out)
+    applied = tail.poll(store)
+    with open(rf, "a") as f:
+        f.write("42\n")
+    applied += tail.poll(store)
+    mark(applied == 1, "Partial line applied once complete", 1, applied)
+
+    # Lines before the offset are counted a block at a time
+    block_size = mr._READ_BLOCK_SIZE
+    mr._READ_BLOCK_SIZE = 7
+    try:
+        counted = mr.RatingsTail(rf).line_no
+    finally:
+        mr._READ_BLOCK_SIZE = block_size
+    with open(rf) as f:
+        expected = f.read().count("\n")
+    mark(counted == expected, "Tail counts existing lines in blocks", expected, counted)
+
+    # 2. Aggregates, per-user view and cached rankings see the new rows
+    reloaded = mr.load_ratings_file(rf)
+    ret = [m for m, _ in engine.movie_popularity(3)]
+    expected = expected_movie_popularity(reloaded, 3)
+    mark(
+        store.as_dict() == reloaded.as_dict() and ret == expected,
+        "Tailed store matches a full reload",
+        expected,
+        ret,
+    )
+
+    # 3. Batch ingestion of rows
+    applied = mr.ingest_ratings_rows(store, ["Heat (1995)|4.0|77", "Heat (1995)|x|77"])
+    mark(
+        applied == 1 and len(store.user_rows(77)) == 1,
+        "ingest_ratings_rows() applies valid rows",
+        1,
+        applied,
+    )
+
+
+# ---------------- Movie Catalog Tests ---------------- #
+
+
+def test_movie_catalog():
+    print("\n=== Movie Catalog Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    plain = movies.as_dict()
+
+    mark(
+        isinstance(movies, mr.MovieCatalog) and dict(movies.items()) == plain,
+        "MovieCatalog dict view",
+    )
+    mark(
+        movies.genre_id("ADVENTURE") == movies.genre_id("adventure ") is not None,
+        "Genre lookup is case-insensitive",
+    )
+
+    # Mixed-case names and genres resolve to the same interned ids
+    mixed = {name.upper(): (genre.lower(), mid) for name, (genre, mid) in plain.items()}
+    ret = mr.genre_popularity(mixed, ratings, 3)
+    expected = mr.genre_popularity(movies, ratings, 3)
+    mark(ret == expected, "Case-insensitive genre_popularity()", expected, ret)
+
+    # A redefined title keeps its position, so a later case variant still decides its genre
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "movies.txt")
+        with open(path, "w") as f:
+            f.write("Drama|1|MOVIE6\nSci-Fi|2|movie6\nAction|3|MOVIE6\nHorror|4|Other\n")
+        redefined = mr.load_movies_file(path)
+    plain = redefined.as_dict()
+    rated = {"movie6": [(5.0, 1)], "Other": [(3.0, 1), (1.0, 2)]}
+    ret = mr.genre_popularity(redefined, rated, 2)
+    expected = expected_genre_popularity(plain, rated, 2)
+    mark(ret == expected, "Redefined case-variant title keeps reference genre", expected, ret)
+    ret = mr.user_preference(redefined, rated, 1)
+    expected = expected_user_preference(plain, rated, 1)
+    mark(ret == expected.title(), "user_preference() with redefined title", expected, ret)
+
+
+def test_genre_index():
+    print("\n=== Genre Index Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    plain_ratings = {name: list(values) for name, values in ratings.items()}
+
+    index = mr._genre_index(movies, ratings)
+    mark(mr._genre_index(movies, ratings) is index, "Genre index cached between calls")
+
+    genre = movies.genre_names[0]
+    ranked = index[movies.genre_id(genre)]
+    expected = expected_movie_popularity_in_genre(movies.as_dict(), plain_ratings, genre, 2)
+    top = [movie for movie, _ in ranked[:2]]
+    mark(top == expected, "Top N in genre is a slice of the index", expected, top)
+    ret = mr.top_movies_in_genre(movies, ratings, genre, 2, offset=1)
+    mark(ret == ranked[1:3], "Offset pages through the index", ranked[1:3], ret)
+
+    user_id = ratings.user_ids()[0]
+    expected, _ = expected_recommendations(user_id, movies.as_dict(), plain_ratings)
+    ret = [movie for movie, _ in mr.recommend_movies_batch(movies, ratings, [user_id])[user_id]]
+    mark(ret == expected, "Recommendations walk the ranked genre list", expected, ret)
+
+    # Appending a rating invalidates the index
+    mr.ingest_ratings_rows(ratings, [f"{ranked[-1][0]}|5.0|{user_id}"])
+    mark(mr._genre_index(movies, ratings) is not index, "Genre index rebuilt after ingest")
+
+
+def test_query_cache():
+    print("\n=== Query Cache Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    cache = mr.QUERY_CACHE
+    cache.invalidate()
+    hits, misses = cache.hits, cache.misses
+
+    with redirect_stdout(io.StringIO()):
+        first = mr.genre_popularity(movies, ratings, 2)
+        second = mr.genre_popularity(movies, ratings, 2)
+        mr.user_preference(movies, ratings, 1)
+        mr.user_preference(movies, ratings, 1)
+    mark(
+        first == second and cache.hits - hits == 2 and cache.misses - misses == 2,
+        "Repeated queries are served from the cache",
+        "2 hits, 2 misses",
+        f"{cache.hits - hits} hits, {cache.misses - misses} misses",
+    )
+
+    # Ingesting ratings changes the dataset version and drops old results
+    name = next(iter(ratings))
+    mr.ingest_ratings_rows(ratings, [f"{name}|0.5|1", f"{name}|0.5|2"])
+    with redirect_stdout(io.StringIO()):
+        ret = mr.genre_popularity(movies, ratings, 2)
+    expected = mr.top_genres(movies, ratings, 2)
+    mark(ret == expected and len(cache) == 1, "Ingest invalidates cached results", expected, ret)
+
+    # A reloaded dataset never sees results cached for the old one
+    reloaded = mr.load_ratings_file("ratings1.txt")
+    with redirect_stdout(io.StringIO()):
+        ret = mr.genre_popularity(movies, reloaded, 2)
+    mark(ret == first, "Reload invalidates cached results", first, ret)
+
+    small = mr.QueryCache(maxsize=2)
+    for n in range(3):
+        small.get("q", (n,), None, reloaded, lambda: n)
+    mark(
+        small.as_dict()["evictions"] == 1 and small.get("q", (0,), None, reloaded, lambda: -1) == -1,
+        "Least recently used entry is evicted",
+    )
+    cache.invalidate()
+
+
+def test_streaming_aggregates():
+    print("\n=== Streaming Aggregates Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    with redirect_stdout(io.StringIO()) as out:
+        aggregates = mr.stream_ratings_aggregates("ratings1.txt")
+    mark(
+        isinstance(aggregates, mr.RatingsAggregates)
+        and aggregates.rows() == ratings.rows()
+        and len(aggregates.rating) == 0,
+        "Streaming keeps only per-movie aggregates",
+    )
+    mark("Loaded" in out.getvalue(), "Streaming prints the loader summary")
+
+    genre = movies.genre_names[0]
+    checks = [
+        (mr.top_movies(aggregates, 10), mr.top_movies(ratings, 10), "top_movies()"),
+        (mr.top_genres(movies, aggregates, 10), mr.top_genres(movies, ratings, 10), "top_genres()"),
+        (
+            mr.top_movies_in_genre(movies, aggregates, genre, 10),
+            mr.top_movies_in_genre(movies, ratings, genre, 10),
+            "top_movies_in_genre()",
+        ),
+    ]
+    for ret, expected, name in checks:
+        mark(ret == expected, f"Streamed {name} matches a full load", expected, ret)
+
+    try:
+        mr.user_preference(movies, aggregates, 1)
+        raised = False
+    except TypeError:
+        raised = True
+    mark(raised, "Per-user queries are rejected on aggregates")
+
+
+def test_compressed_input():
+    print("\n=== Compressed Input Tests ===")
+    import bz2
+    import gzip
+    import lzma
+
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    with tempfile.TemporaryDirectory() as tmp:
+        for ext, module in ((".gz", gzip), (".bz2", bz2), (".xz", lzma)):
+            paths = {}
+            for name in ("movies1.txt", "ratings1.txt"):
+                with open(name, "rb") as src:
+                    data = src.read()
+                # Without the extension the format must be sniffed from magic bytes
+                for by_ext, path in (
+                    (True, os.path.join(tmp, name + ext)),
+                    (False, os.path.join(tmp, ext[1:] + "-" + name)),
+                ):
+                    with module.open(path, "wb") as dst:
+                        dst.write(data)
+                    paths[name, by_ext] = path
+
+            for by_ext in (True, False):
+                how = "extension" if by_ext else "magic bytes"
+                with redirect_stdout(io.StringIO()):
+                    ret_movies = mr.load_movies_file(paths["movies1.txt", by_ext])
+                    ret_ratings = mr.load_ratings_file(paths["ratings1.txt", by_ext], workers=2)
+                mark(
+                    dict(ret_movies.items()) == dict(movies.items())
+                    and ret_ratings.as_dict() == ratings.as_dict(),
+                    f"{ext} input detected by {how}",
+                )
+
+
+def test_sharded_loading():
+    print("\n=== Sharded Loading Tests ===")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    with open("ratings1.txt") as f:
+        lines = f.readlines()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shard_dir = os.path.join(tmp, "shards")
+        os.mkdir(shard_dir)
+        size = len(lines) // 3 + 1
+        for i in range(3):
+            with open(os.path.join(shard_dir, f"day{i}.txt"), "w") as f:
+                f.writelines(lines[i * size : (i + 1) * size])
+
+        with redirect_stdout(io.StringIO()):
+            by_dir = mr.load_ratings_shards(shard_dir, workers=2)
+            by_glob = mr.load_ratings_shards(os.path.join(shard_dir, "day*.txt"), workers=1)
+            aggregates = mr.load_ratings_shards(shard_dir, aggregates_only=True)
+        mark(by_dir.as_dict() == ratings.as_dict(), "Directory of shards merges into one store")
+        mark(by_glob.as_dict() == ratings.as_dict(), "Glob of shards merges into one store")
+        mark(
+            isinstance(aggregates, mr.RatingsAggregates)
+            and list(aggregates.movie_count) == list(ratings.movie_count),
+            "Shards merge into aggregates only",
+        )
+
+        # An existing file with glob characters in its name is a plain file
+        bracketed = os.path.join(tmp, "ratings[2024].txt")
+        with open(bracketed, "w") as f:
+            f.writelines(lines)
+        mark(
+            not mr._is_sharded(bracketed) and mr._is_sharded(os.path.join(tmp, "ratings[0-9].txt")),
+            "Existing file named like a glob is not treated as shards",
+        )
+
+        # Duplicate movies across catalogues: later file wins by default
+        extra = os.path.join(tmp, "extra_movies.txt")
+        with open(extra, "w") as f:
+            f.write("Horror|999|Toy Story (1995)\nDrama|1000|New Movie (2020)\n")
+        with redirect_stdout(io.StringIO()):
+            last = mr.load_movies_files(["movies1.txt", extra])
+            first = mr.load_movies_files(["movies1.txt", extra], duplicates="first")
+        mark(
+            last["Toy Story (1995)"] == ("Horror", "999") and "New Movie (2020)" in last,
+            "Later catalogue wins for duplicate movies",
+            ("Horror", "999"),
+            last.get("Toy Story (1995)"),
+        )
+        mark(first["Toy Story (1995)"][1] != "999", "duplicates='first' keeps the earlier definition")
+        try:
+            with redirect_stdout(io.StringIO()):
+                mr.load_movies_files(["movies1.txt", extra], duplicates="error")
+            raised = False
+        except ValueError:
+            raised = True
+        mark(raised, "duplicates='error' rejects duplicate movies")
+
+        # The server loads catalogues and shards the same way as --queries
+        with redirect_stdout(io.StringIO()):
+            snapshot = mr.DatasetSnapshot.load(f"movies1.txt,{extra}", shard_dir)
+        mark(
+            snapshot.ratings.as_dict() == ratings.as_dict()
+            and snapshot.movies["New Movie (2020)"] == ("Drama", "1000"),
+            "Snapshots load comma-separated catalogues and ratings shards",
+        )
+
+
+def test_load_report():
+    print("\n=== Load Report Tests ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        dirty = os.path.join(tmp, "dirty_ratings.txt")
+        with open("ratings1.txt") as src, open(dirty, "w") as dst:
+            dst.write(src.read())
+            dst.write("no separators here\nToy Story (1995)|great|3\nanother bad line\n")
+        movies_file = os.path.join(tmp, "dirty_movies.txt")
+        with open("movies1.txt") as src, open(movies_file, "w") as dst:
+            dst.write(src.read() + "Drama|only two\n")
+        quarantine = os.path.join(tmp, "rejected.txt")
+
+        report = mr.LoadReport(max_examples=1, quarantine=quarantine)
+        with redirect_stdout(io.StringIO()) as out:
+            ratings = mr.load_ratings_file(dirty, workers=2, errors=report)
+            mr.load_movies_file(movies_file, errors=report)
+        report.close()
+        summary = report.as_dict()
+
+        with redirect_stdout(io.StringIO()):
+            clean = mr.load_ratings_file("ratings1.txt")
+        mark(ratings.as_dict() == clean.as_dict(), "Bad rows are still skipped with a report")
+        mark(
+            summary["counts"] == {"malformed": 3, "invalid": 1},
+            "Rejected rows counted per category",
+            {"malformed": 3, "invalid": 1},
+            summary["counts"],
+        )
+        mark(
+            len(summary["examples"]["malformed"]) == 1
+            and summary["examples"]["malformed"][0]["text"] == "no separators here",
+            "Only the first K examples are kept",
+        )
+        mark("Skipping" not in out.getvalue(), "No warning is printed per bad row")
+        with open(quarantine) as f:
+            rejected = f.read().splitlines()
+        expected = [
+            "no separators here",
+            "Toy Story (1995)|great|3",
+            "another bad line",
+            "Drama|only two",
+        ]
+        mark(rejected == expected, "Rejected rows written to the quarantine file", expected, rejected)
+
+        # A clean run empties the previous run's quarantine file
+        report = mr.LoadReport(quarantine=quarantine)
+        with redirect_stdout(io.StringIO()):
+            mr.load_ratings_file("ratings1.txt", errors=report)
+        report.close()
+        with open(quarantine) as f:
+            leftover = f.read()
+        mark(leftover == "", "Clean load leaves an empty quarantine file", "", leftover)
+
+        # A snapshot from an earlier run must not hide the dirty rows
+        runs = []
+        for _ in range(2):
+            report = mr.LoadReport(quarantine=quarantine)
+            with redirect_stdout(io.StringIO()):
+                mr.load_ratings_file(dirty, snapshot=True, errors=report)
+                mr.load_movies_file(movies_file, snapshot=True, errors=report)
+            report.close()
+            with open(quarantine) as f:
+                runs.append((report.as_dict()["counts"], f.read().splitlines()))
+        mark(
+            runs[1] == runs[0] == ({"malformed": 3, "invalid": 1}, expected),
+            "Report and quarantine are complete when a snapshot exists",
+            runs[0],
+            runs[1],
+        )
+
+
+def test_recommendation_table():
+    print("\n=== Recommendation Table Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    table = mr.RecommendationTable.build(movies, ratings, k=3)
+    expected = mr.recommend_movies_batch(movies, ratings, k=3)
+    ret = {user_id: table.lookup(user_id)[1] for user_id in ratings.user_ids()}
+    mark(ret == expected, "Table matches recommend_movies_batch()", expected, ret)
+
+    for user_id in ratings.user_ids():
+        with redirect_stdout(io.StringIO()) as live:
+            mr.recommend_movies(user_id, movies, ratings)
+        with redirect_stdout(io.StringIO()) as cached:
+            mr.recommend_movies(user_id, movies, ratings, table=table)
+        if live.getvalue() != cached.getvalue():
+            break
+    mark(
+        live.getvalue() == cached.getvalue(),
+        "recommend_movies() output is the same from the table",
+        live.getvalue(),
+        cached.getvalue(),
+    )
+
+    # Same ratings under another catalogue: the table is stale and must be ignored
+    genres = [genre for genre, _ in movies.values()]
+    other = mr.MovieCatalog.from_dict(
+        {name: (genres[i - 1], mid) for i, (name, (_, mid)) in enumerate(movies.items())}
+    )
+    live = mr.QueryEngine(other, ratings)
+    tabled = mr.QueryEngine(other, ratings, table=table)
+    expected = [live.recommend_movies(user_id) for user_id in ratings.user_ids()]
+    ret = [tabled.recommend_movies(user_id) for user_id in ratings.user_ids()]
+    mark(
+        not table.is_current(other, ratings) and ret == expected,
+        "Table built for another catalogue is not used",
+        expected,
+        ret,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "recs.bin")
+        table.save(path)
+        loaded = mr.RecommendationTable.load(path)
+        mark(
+            loaded.entries() == table.entries() and 12345 not in loaded,
+            "Saved table is memory-mapped back unchanged",
+        )
+
+        # Only users touched by the new ratings are recomputed
+        user_id = ratings.user_ids()[0]
+        mr.ingest_ratings_rows(ratings, [f"{movies.names[0]}|1.0|{user_id}"])
+        recomputed = loaded.update(movies, ratings)
+        rebuilt = mr.RecommendationTable.build(movies, ratings, k=3)
+        mark(
+            loaded.entries() == rebuilt.entries() and 0 < recomputed <= len(rebuilt),
+            "update() matches a full rebuild",
+            len(rebuilt),
+            recomputed,
+        )
+        mark(loaded.update(movies, ratings) == 0, "update() is a no-op when nothing changed")
+        del loaded
+
+        # A new case variant of a rated title takes over the join, dropping
+        # the older spelling from its raters' genre averages
+        movies_file = os.path.join(tmp, "variant_movies.txt")
+        ratings_file = os.path.join(tmp, "variant_ratings.txt")
+        with open(movies_file, "w") as f:
+            f.write("G|1|Inception\nG|2|Other G\nH|3|H1\nG|4|G3\n")
+        with open(ratings_file, "w") as f:
+            f.write("Inception|1.0|1\nOther G|5.0|1\nH1|4.0|1\nG3|3.0|2\n")
+        variant_movies = mr.load_movies_file(movies_file)
+        variant_ratings = mr.load_ratings_file(ratings_file)
+        variant = mr.RecommendationTable.build(variant_movies, variant_ratings, k=3)
+        mr.ingest_ratings_rows(variant_ratings, ["inception|2.0|2"])
+        variant.update(variant_movies, variant_ratings)
+        rebuilt = mr.RecommendationTable.build(variant_movies, variant_ratings, k=3)
+        mark(
+            variant.entries() == rebuilt.entries() and variant.lookup(1) == ("G", [("G3", 3.0)]),
+            "update() recomputes raters of a title replaced by a case variant",
+            rebuilt.entries(),
+            variant.entries(),
+        )
+
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(data[:-8])
+        try:
+            mr.RecommendationTable.load(path)
+            rejected = False
+        except ValueError:
+            rejected = True
+        mark(rejected, "Truncated table is rejected by load()")
+
+
+def test_dataset_snapshots():
+    print("\n=== Dataset Snapshot Tests ===")
+    movies = mr.load_movies_file("movies1.txt")
+    ratings = mr.load_ratings_file("ratings1.txt")
+    snapshot = mr.DatasetSnapshot(movies, ratings)
+    try:
+        snapshot.ratings = {}
+        immutable = False
+    except AttributeError:
+        immutable = True
+    mark(immutable, "DatasetSnapshot rejects attribute assignment")
+
+    queries = [{"query": "genre_popularity", "n": 3}] + [
+        {"query": "recommend_movies", "user_id": user_id} for user_id in ratings.user_ids()
+    ]
+    expected = [mr.QueryEngine(movies, ratings).run(query) for query in queries]
+    live = mr.LiveDataset(snapshot)
+    with mr.SnapshotQueryExecutor(live, max_workers=4) as executor:
+        ret = executor.map(queries)
+        mark(ret == expected, "Thread pool answers match serial queries", expected, ret)
+
+        # Copy-on-write: readers holding the old snapshot keep the old data
+        name = ratings.names[0]
+        with redirect_stdout(io.StringIO()):
+            live.ingest([f"{name}|0.5|{uid}" for uid in range(1000, 1010)])
+        mark(
+            snapshot.run(queries[0]) == expected[0]
+            and live.current().run(queries[0]) != expected[0]
+            and live.current().generation == 1,
+            "Ingest publishes a new snapshot and leaves the old one intact",
+        )
+
+        # Queries racing with ingests always see one whole generation
+        snapshots = [live.current()]
+        futures = []
+        with redirect_stdout(io.StringIO()):
+            for i in range(5):
+                futures += [executor.submit(query) for query in queries]
+                live.ingest([f"{name}|5.0|{2000 + i}"])
+                snapshots.append(live.current())
+        answers = [[snap.run(query) for query in queries] for snap in snapshots]
+        results = [future.result() for future in futures]
+        consistent = all(
+            any(result == answers[g][i % len(queries)] for g in range(len(snapshots)))
+            for i, result in enumerate(results)
+        )
+        mark(consistent, "Concurrent readers never see a half-updated dataset")
+
+    # Snapshots share the rating columns and each reads up to its own row count
+    original = mr.load_ratings_file("ratings1.txt")
+    newest = live.current().ratings
+    mark(
+        newest.rating is snapshot.ratings.rating
+        and snapshot.ratings.rows() == original.rows() < newest.rows()
+        and snapshot.ratings.as_dict() == original.as_dict(),
+        "Ingest shares columns; old snapshots stop at their row count",
+    )
+    with redirect_stdout(io.StringIO()):
+        branch, _ = snapshot.with_rows([f"{name}|1.0|3000"])
+    mark(
+        branch.ratings.rows() == original.rows() + 1
+        and branch.ratings.rating is not newest.rating
+        and live.current().ratings.rows() == newest.rows(),
+        "Ingesting into an older snapshot branches off a copy",
+    )
+    try:
+        snapshot.ratings.append(name, 1.0, 1)
+        read_only = False
+    except TypeError:
+        read_only = True
+    mark(read_only, "Snapshot ratings are read-only")
+
+
+def test_differential_harness():
+    print("\n=== Differential Harness Tests ===")
+    import benchmark_movie_recommender as bench
+    import differential_movie_recommender as diff
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mf, rf = bench.generate_dataset(tmp, 5000, seed=3)
+        results = diff.run_differential(mf, rf, queries=5, seed=3)
+        mf, rf = diff.generate_messy_dataset(tmp, 5000, seed=3)
+        messy = diff.run_differential(mf, rf, queries=5, seed=3)
+    engines = {r["engine"]: r for r in results}
+    mark(
+        {
+            "reference", "indexed", "functions", "cached", "parallel",
+            "shards", "mmap", "streaming", "table", "snapshot", "incremental",
+        }
+        <= set(engines),
+        "Differential harness covers every optimised engine",
+    )
+    mark(
+        engines["streaming"]["queries"] == 15 and engines["table"]["queries"] == 5,
+        "Engines are only checked on the queries they answer",
+    )
+    mark(
+        all(r["mismatches"] == 0 for r in results + messy),
+        "Every engine matches the reference on clean and messy data",
+        None,
+        [r["examples"] for r in results + messy if r["mismatches"]],
+    )
+    mark(
+        all(r["load_s"] >= 0 and r["query_s"] >= 0 for r in results),
+        "Differential harness times every engine against the reference",
+    )
+
+    movies = {"A": ("Drama", "1"), "B": ("Drama", "2")}
+    ratings = {"A": [(4.0, 1)], "B": [(4.0, 2)]}
+    answers = diff.reference_answers(movies, ratings, [("movie_popularity", 5)])
+    mark(answers == [[("A", 4.0), ("B", 4.0)]], "Reference answers keep tie order")
+
+
 # ---------------- Main ---------------- #
 
 
@@ -229,6 +1261,27 @@ def main():
     print("=== Automated Tester: movie_recommender.py ===")
     test_feature_coverage()
     test_edge_cases()
+    test_ratings_store()
+    test_ranking_api()
+    test_parallel_loader()
+    test_snapshot_cache()
+    test_batch_recommendations()
+    test_batch_queries()
+    test_query_server()
+    test_benchmark_suite()
+    test_instrumentation()
+    test_item_engine()
+    test_incremental_ingestion()
+    test_movie_catalog()
+    test_genre_index()
+    test_query_cache()
+    test_streaming_aggregates()
+    test_compressed_input()
+    test_sharded_loading()
+    test_load_report()
+    test_recommendation_table()
+    test_dataset_snapshots()
+    test_differential_harness()
 
     total = PASS + FAIL
     print("\n=== Test Summary ===")